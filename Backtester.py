@@ -1,50 +1,214 @@
+from abc import ABC, abstractmethod
 import datetime
+import os
+import pickle
 import time
-from Brokerage import Brokerage
-from DB import Event
-from HistoricalData import HistoricalData
-from Strategy import Strategy
+from typing import Callable, Iterator, Sequence
+import numpy as np
+from Brokerage import ORDER_SIDE_BUY, ORDER_SIDE_SELL, Brokerage, Order
+from DB import Event, to_datetime, to_epoch
+from HistoricalData import HistoricalData, OHLCVPanel, PanelBatch
+from Results import ResultsRecorder
+from Strategy import Strategy, VectorizedStrategy
 
-class Backtester:
-    _brokerage: Brokerage
-    _strategy: Strategy
+class BaseBacktester(ABC):
+    # the day-closing loop, run modes, logging and checkpointing shared by Backtester and MultiBacktester. Subclasses
+    # say what handling an event group and closing a day mean for their strategy/brokerage pairs
     _historical_data: HistoricalData
+    _verbose: bool
+    _log_every: int
+    _days_ended: int
+    # the arguments of the last run, which resume continues with
+    _run_options: dict | None
+    _closed_through: datetime.date | None
+    _checkpoint_every: int
+    _checkpoint_path: str | None
 
-    def __init__(self, strategy: Strategy, brokerage: Brokerage, historical_data: HistoricalData):
-        self._strategy = strategy
-        self._brokerage = brokerage
+    def __init__(self, historical_data: HistoricalData, verbose: bool = True, log_every: int = 20):
+        # verbose prints every log_every-th day closed out (1 for every day)
         self._historical_data = historical_data
+        self._verbose = verbose
+        self._log_every = log_every
+        self._days_ended = 0
+        self._reset_run_state()
+
+    @abstractmethod
+    def get_pairs(self) -> list[tuple[Strategy, Brokerage]]:
+        pass
+
+    @abstractmethod
+    def get_equity_curves(self) -> list[list[tuple[datetime.date, int]]]:
+        # one curve per pair, in get_pairs order
+        pass
+
+    @abstractmethod
+    def get_recorders(self) -> list[ResultsRecorder | None]:
+        # one entry per pair, None where a pair isn't recorded
+        pass
+
+    def get_historical_data(self) -> HistoricalData:
+        return self._historical_data
+
+    def get_closed_through(self) -> datetime.date | None:
+        # the last day closed out, which a resume continues after
+        return self._closed_through
+
+    def run(self, start_date: datetime.date, end_date: datetime.date, stream: bool = False, chunk_size: int = 10000, prefetch_depth: int = 0,
+            skip_inactive_days: bool = False, checkpoint_every: int = 0, checkpoint_path: str | None = None):
+        # prefetch_depth > 0 streams with the next batches read and decoded on a background thread.
+        # skip_inactive_days only closes out (and records equity for) days that have events.
+        # Vectorized strategies always take the batched simulation, which ignores stream, chunk_size and prefetch_depth.
+        # With a checkpoint_path the whole backtester is saved there every checkpoint_every days closed out (0 for never)
+        # and once the run ends, for load_checkpoint to resume or fork
+        self._run_options = {"start_date": start_date, "end_date": end_date, "stream": stream, "chunk_size": chunk_size,
+                             "prefetch_depth": prefetch_depth, "skip_inactive_days": skip_inactive_days}
+        self._closed_through = None
+        self._checkpoint_every = checkpoint_every
+        self._checkpoint_path = checkpoint_path
+        return self._run(start_date)
+
+    def resume(self, end_date: datetime.date | None = None):
+        # continues the last run, in the same mode and with the same checkpointing, from the day after the last one
+        # closed out. end_date extends or shortens the run
+        if self._run_options is None:
+            raise ValueError("Nothing to resume, the backtester hasn't been run")
 
-    def run(self, start_date: datetime.date, end_date: datetime.date):
+        if end_date is not None:
+            self._run_options["end_date"] = end_date
+
+        if self._closed_through is None:
+            return self._run(self._run_options["start_date"])
+        return self._run(self._closed_through + datetime.timedelta(days=1))
+
+    def set_checkpointing(self, checkpoint_path: str | None, checkpoint_every: int = 0):
+        # changes where and how often the rest of the run (or a resume) checkpoints; None turns checkpoints off
+        self._checkpoint_path = checkpoint_path
+        self._checkpoint_every = checkpoint_every
+
+    def save_checkpoint(self, path: str):
+        # written to a temporary file and moved into place, so an interrupted save leaves the previous checkpoint intact
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as output:
+            pickle.dump(self, output, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+
+    def _reset_run_state(self):
+        self._run_options = None
+        self._closed_through = None
+        self._checkpoint_every = 0
+        self._checkpoint_path = None
+
+    def _run(self, start_date: datetime.date):
+        options = self._run_options
+        end_date = options["end_date"]
+        if self._is_vectorized():
+            result = self._run_vectorized(options["start_date"], start_date, end_date, options["skip_inactive_days"])
+        elif options["stream"] or options["prefetch_depth"] > 0:
+            result = self._run_streaming(start_date, end_date, options["chunk_size"], options["prefetch_depth"], options["skip_inactive_days"])
+        else:
+            result = self._run_days(start_date, end_date, options["skip_inactive_days"])
+
+        if self._checkpoint_path is not None:
+            self.save_checkpoint(self._checkpoint_path)
+        return result
+
+    def _run_days(self, start_date: datetime.date, end_date: datetime.date, skip_inactive_days: bool):
         # proceed one day at a time
         start_datetime = datetime.datetime.combine(start_date, datetime.time(0, 0, 0))
         self._historical_data.update_timestamp(start_datetime)
-        
-        current_date = start_date
-        current_date_end = self._get_end_of_day(current_date)
 
-        while current_date_end <= self._get_end_of_day(end_date):
-            day_events = self._historical_data.get_events_unrestricted(current_date, current_date_end)
+        days = self._historical_data.get_trading_days(start_date, end_date) if skip_inactive_days else None
+        if days is None:
+            days = [start_date + datetime.timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+        settled_through = start_date - datetime.timedelta(days=1)
+        for current_date in days:
+            settled_through = self._settle_inactive_days(settled_through, current_date)
+
+            day_events = self._historical_data.get_events_unrestricted(current_date, self._get_end_of_day(current_date))
 
             for events in self._group_events_by_begin_time(day_events):
-                self._historical_data.update_timestamp(events[0].end)
-                self._brokerage.handle_events(events)
-                self._strategy.run(events[0].end, events, self._brokerage, self._historical_data)
+                self._handle_event_group(events)
+
+            self._end_day(current_date)
+            settled_through = current_date
 
-            self._brokerage.handle_end_of_day(current_date)
+        self._settle_inactive_days(settled_through, end_date + datetime.timedelta(days=1))
+        return self._get_result()
 
+    def _run_streaming(self, start_date: datetime.date, end_date: datetime.date, chunk_size: int, prefetch_depth: int = 0,
+                       skip_inactive_days: bool = False):
+        # a single ordered cursor over the whole range instead of one query per calendar day. Prefetched batches wait
+        # in a queue until the loop reaches them, so nothing ahead of the clock is handed to the strategy
+        start_datetime = datetime.datetime.combine(start_date, datetime.time(0, 0, 0))
+        self._historical_data.update_timestamp(start_datetime)
+
+        if prefetch_depth > 0:
+            batches = self._historical_data.prefetch_event_batches(start_date, self._get_end_of_day(end_date), chunk_size, prefetch_depth)
+        else:
+            batches = self._historical_data.stream_event_batches(start_date, self._get_end_of_day(end_date), chunk_size)
+
+        return self._run_batches(start_date, end_date, batches, skip_inactive_days, self._handle_event_group)
+
+    def _run_batches(self, start_date: datetime.date, end_date: datetime.date, batches: Iterator[Sequence[Event]], skip_inactive_days: bool,
+                     handle_batch: Callable[[Sequence[Event]], None]):
+        current_date = start_date
+        # with skip_inactive_days, the last day that had events and hasn't been closed out yet
+        open_date = None
+        settled_through = start_date - datetime.timedelta(days=1)
+        for events in batches:
+            event_date = to_datetime(events[0].begin).date()
+
+            if skip_inactive_days:
+                # the stream itself says which days are active, so no calendar is needed
+                if event_date != open_date:
+                    if open_date is not None:
+                        self._end_day(open_date)
+                        settled_through = open_date
+                    settled_through = self._settle_inactive_days(settled_through, event_date)
+                    open_date = event_date
+            else:
+                # close out every day before this group, including days with no events
+                while current_date < event_date:
+                    self._end_day(current_date)
+                    current_date = current_date + datetime.timedelta(days=1)
+
+            handle_batch(events)
+
+        if skip_inactive_days:
+            if open_date is not None:
+                self._end_day(open_date)
+                settled_through = open_date
+            self._settle_inactive_days(settled_through, end_date + datetime.timedelta(days=1))
+            return self._get_result()
+
+        while current_date <= end_date:
+            self._end_day(current_date)
             current_date = current_date + datetime.timedelta(days=1)
-            current_date_end = self._get_end_of_day(current_date)
-            print(f"Processed day {current_date}: market value {self._brokerage.get_brokerage_value()}")
 
-        return self._brokerage.get_brokerage_value()
-    
+        return self._get_result()
 
-        
+    def _settle_inactive_days(self, settled_through: datetime.date, next_date: datetime.date) -> datetime.date:
+        # settles the days after settled_through and before next_date that are being skipped, such as dividends paid
+        # on a weekend. Settling pays out everything due on or before the given day, so one call covers the whole gap
+        last_skipped = next_date - datetime.timedelta(days=1)
+        if last_skipped > settled_through:
+            self._settle_day(last_skipped)
+            return last_skipped
+        return settled_through
+
+    def _should_log_day(self) -> bool:
+        self._days_ended += 1
+        return self._verbose and (self._days_ended - 1) % self._log_every == 0
+
+    def _day_closed(self, date: datetime.date):
+        self._closed_through = date
+        if self._checkpoint_path is not None and self._checkpoint_every > 0 and self._days_ended % self._checkpoint_every == 0:
+            self.save_checkpoint(self._checkpoint_path)
 
     def _get_end_of_day(self, date: datetime.date) -> datetime.datetime:
         return datetime.datetime.combine(date, datetime.time(23, 59, 59, 999999))
-    
+
     def _group_events_by_begin_time(self, events: list[Event]) -> list[list[Event]]:
         events_by_begin = {}
         for event in events:
@@ -53,3 +217,195 @@ class Backtester:
             events_by_begin[event.begin].append(event)
 
         return [events_by_begin[end_time] for end_time in sorted(events_by_begin)]
+
+    def _is_vectorized(self) -> bool:
+        return False
+
+    @abstractmethod
+    def _handle_event_group(self, events: Sequence[Event]):
+        pass
+
+    @abstractmethod
+    def _settle_day(self, date: datetime.date):
+        pass
+
+    @abstractmethod
+    def _end_day(self, date: datetime.date):
+        pass
+
+    @abstractmethod
+    def _get_result(self):
+        pass
+
+
+class Backtester(BaseBacktester):
+    _brokerage: Brokerage
+    _strategy: Strategy
+    _equity_curve: list[tuple[datetime.date, int]]
+    _recorder: ResultsRecorder | None
+
+    def __init__(self, strategy: Strategy, brokerage: Brokerage, historical_data: HistoricalData, verbose: bool = True,
+                 log_every: int = 20, recorder: ResultsRecorder | None = None):
+        # recorder collects the run for analysis
+        super().__init__(historical_data, verbose, log_every)
+        self._strategy = strategy
+        self._brokerage = brokerage
+        self._equity_curve = []
+        self._recorder = recorder
+
+    def get_equity_curve(self) -> list[tuple[datetime.date, int]]:
+        return self._equity_curve
+
+    def get_strategy(self) -> Strategy:
+        return self._strategy
+
+    def get_brokerage(self) -> Brokerage:
+        return self._brokerage
+
+    def get_recorder(self) -> ResultsRecorder | None:
+        return self._recorder
+
+    def get_pairs(self) -> list[tuple[Strategy, Brokerage]]:
+        return [(self._strategy, self._brokerage)]
+
+    def get_equity_curves(self) -> list[list[tuple[datetime.date, int]]]:
+        return [self._equity_curve]
+
+    def get_recorders(self) -> list[ResultsRecorder | None]:
+        return [self._recorder]
+
+    def _run_vectorized(self, start_date: datetime.date, resume_date: datetime.date, end_date: datetime.date, skip_inactive_days: bool):
+        # indicators and targets for the whole range are computed up front. The loop then only feeds each panel row to the
+        # historical data and brokerage, which decode just the bars they ask for, and trades on the rows where targets change.
+        # A resumed run computes them from start_date as before, so its indicators are warmed up, and feeds the rows from resume_date
+        start_datetime = datetime.datetime.combine(start_date, datetime.time(0, 0, 0))
+        resume_datetime = datetime.datetime.combine(resume_date, datetime.time(0, 0, 0))
+        self._historical_data.update_timestamp(resume_datetime)
+
+        panel = self._historical_data.get_ohlcv_panel(start_datetime, self._get_end_of_day(end_date), self._strategy.get_tickers())
+        indicators = {name: indicator.compute(panel) for name, indicator in self._strategy.get_indicators().items()}
+        targets = np.asarray(self._strategy.get_targets(panel, indicators), dtype=np.float64)
+        rebalance_rows = set(get_rebalance_rows(targets).tolist())
+
+        def handle_batch(batch: PanelBatch):
+            self._historical_data.update_timestamp(batch[0].end)
+            self._historical_data.handle_events(batch)
+            self._brokerage.handle_events(batch)
+            if batch.row in rebalance_rows:
+                self._brokerage.submit_orders(self._get_rebalance_orders(panel, targets[batch.row]))
+
+        first_row = int(np.searchsorted(panel.begin, to_epoch(resume_datetime), side="left"))
+        return self._run_batches(resume_date, end_date, panel.iterate_batches(first_row), skip_inactive_days, handle_batch)
+
+    def _get_rebalance_orders(self, panel: OHLCVPanel, targets: np.ndarray) -> list[Order]:
+        # market orders taking each targeted ticker from what is held to its target, sells first to free up cash
+        held = {}
+        for position in self._brokerage.get_positions():
+            held[position.symbol] = held.get(position.symbol, 0) + position.quantity
+
+        sells, buys = [], []
+        for column in np.flatnonzero(~np.isnan(targets)).tolist():
+            ticker = panel.tickers[column]
+            change = int(targets[column]) - held.get(ticker, 0)
+            if change < 0:
+                sells.append(Order(ticker, -change, ORDER_SIDE_SELL))
+            elif change > 0:
+                buys.append(Order(ticker, change, ORDER_SIDE_BUY))
+        return sells + buys
+
+    def _is_vectorized(self) -> bool:
+        return isinstance(self._strategy, VectorizedStrategy)
+
+    def _settle_day(self, date: datetime.date):
+        self._brokerage.handle_end_of_day(date)
+
+    def _handle_event_group(self, events: Sequence[Event]):
+        self._historical_data.update_timestamp(events[0].end)
+        self._historical_data.handle_events(events)
+        self._brokerage.handle_events(events)
+        self._strategy.run(events[0].end, events, self._brokerage, self._historical_data)
+
+    def _end_day(self, date: datetime.date):
+        self._brokerage.handle_end_of_day(date)
+
+        value = self._brokerage.get_brokerage_value()
+        self._equity_curve.append((date, value))
+        if self._recorder is not None:
+            self._recorder.record_day(date, value, self._brokerage)
+
+        if self._should_log_day():
+            print(f"Processed day {date}: market value {value}")
+        self._day_closed(date)
+
+    def _get_result(self):
+        return self._brokerage.get_brokerage_value()
+
+
+class MultiBacktester(BaseBacktester):
+    # drives several independent strategy/brokerage pairs from one event feed, so events are read and decoded once
+    _pairs: list[tuple[Strategy, Brokerage]]
+    _equity_curves: list[list[tuple[datetime.date, int]]]
+    _recorders: list[ResultsRecorder] | None
+
+    def __init__(self, pairs: list[tuple[Strategy, Brokerage]], historical_data: HistoricalData, verbose: bool = True,
+                 log_every: int = 20, recorders: list[ResultsRecorder] | None = None):
+        # recorders, when given, has one recorder per pair
+        super().__init__(historical_data, verbose, log_every)
+        self._pairs = pairs
+        self._equity_curves = [[] for _ in pairs]
+        self._recorders = recorders
+
+    def get_equity_curves(self) -> list[list[tuple[datetime.date, int]]]:
+        return self._equity_curves
+
+    def get_pairs(self) -> list[tuple[Strategy, Brokerage]]:
+        return self._pairs
+
+    def get_recorders(self) -> list[ResultsRecorder | None]:
+        return [None] * len(self._pairs) if self._recorders is None else self._recorders
+
+    def _handle_event_group(self, events: Sequence[Event]):
+        self._historical_data.update_timestamp(events[0].end)
+        self._historical_data.handle_events(events)
+
+        for strategy, brokerage in self._pairs:
+            brokerage.handle_events(events)
+            strategy.run(events[0].end, events, brokerage, self._historical_data)
+
+    def _settle_day(self, date: datetime.date):
+        for _, brokerage in self._pairs:
+            brokerage.handle_end_of_day(date)
+
+    def _end_day(self, date: datetime.date):
+        values = []
+        for (_, brokerage), equity_curve in zip(self._pairs, self._equity_curves):
+            brokerage.handle_end_of_day(date)
+
+            value = brokerage.get_brokerage_value()
+            equity_curve.append((date, value))
+            values.append(value)
+
+        if self._recorders is not None:
+            for (_, brokerage), recorder, value in zip(self._pairs, self._recorders, values):
+                recorder.record_day(date, value, brokerage)
+
+        if self._should_log_day():
+            print(f"Processed day {date}: market values {values}")
+        self._day_closed(date)
+
+    def _get_result(self) -> list[int]:
+        return [brokerage.get_brokerage_value() for _, brokerage in self._pairs]
+
+
+def load_checkpoint(path: str) -> BaseBacktester:
+    # every load is an independent copy of the saved state, so one warm-up checkpoint can seed any number of runs.
+    # Data sources reconnect or reload from where they were loaded from
+    with open(path, "rb") as input:
+        return pickle.load(input)
+
+
+def get_rebalance_rows(targets: np.ndarray) -> np.ndarray:
+    # rows whose targets differ from the row before, with NaN matching NaN; the first row counts when it targets anything
+    previous = np.vstack([np.full((1, targets.shape[1]), np.nan), targets[:-1]])
+    unchanged = (targets == previous) | (np.isnan(targets) & np.isnan(previous))
+    return np.flatnonzero(~unchanged.all(axis=1))
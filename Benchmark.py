@@ -0,0 +1,157 @@
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import tempfile
+import time
+from typing import Callable
+from Backtester import Backtester
+from Brokerage import SimpleBrokerage
+from DB import EVENT_TYPE_OHLCV, OHLCV, SqliteDB
+from HistoricalData import SQLHistoricalData
+from Strategy import Strategy
+from SyntheticData import generate_event_database
+
+class BuyUniverseStrategy(Strategy):
+    # spreads the cash across the first few tickers it sees so valuation has positions to price
+    _tickers: int
+    _bought: set[str]
+
+    def __init__(self, tickers: int):
+        self._tickers = tickers
+        self._bought = set()
+
+    def run(self, timestamp, events, brokerage, historical_data):
+        for event in events:
+            if len(self._bought) >= self._tickers:
+                return
+            if not isinstance(event, OHLCV) or event.ticker in self._bought:
+                continue
+
+            price = brokerage.get_ticker_price(event.ticker)
+            if price is None:
+                continue
+
+            quantity = int(brokerage.get_cash() // (self._tickers - len(self._bought)) // price[1])
+            if quantity > 0:
+                brokerage.place_buy_trade(event.ticker, quantity)
+            self._bought.add(event.ticker)
+
+def measure_latency(function: Callable, arguments: list[tuple]) -> dict[str, float]:
+    durations = []
+    for args in arguments:
+        started = time.perf_counter()
+        function(*args)
+        durations.append(time.perf_counter() - started)
+
+    durations.sort()
+    return {
+        "calls": len(durations),
+        "p50_ms": durations[len(durations) // 2] * 1000,
+        "p99_ms": durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1000,
+    }
+
+def benchmark_backtest(db_path: str, start_date: datetime.date, end_date: datetime.date, stream: bool, prefetch_depth: int = 0) -> dict[str, float]:
+    db = SqliteDB(db_path)
+    event_count = db.db_connection.execute("SELECT COUNT(*) FROM event WHERE begin >= ? AND begin <= ?",
+                                           [start_date, datetime.datetime.combine(end_date, datetime.time(23, 59, 59, 999999))]).fetchone()[0]
+
+    historical_data = SQLHistoricalData(db)
+    backtester = Backtester(BuyUniverseStrategy(10), SimpleBrokerage(100000000, historical_data), historical_data, verbose=False)
+
+    started = time.perf_counter()
+    backtester.run(start_date, end_date, stream=stream, prefetch_depth=prefetch_depth)
+    elapsed = time.perf_counter() - started
+
+    return {"events": event_count, "seconds": elapsed, "events_per_second": event_count / elapsed if elapsed > 0 else 0.0}
+
+def benchmark_latencies(db_path: str, start_date: datetime.date, end_date: datetime.date, samples: int, seed: int = 0) -> dict[str, dict[str, float]]:
+    rng = random.Random(seed)
+    db = SqliteDB(db_path)
+    tickers = [row[0] for row in db.db_connection.execute("SELECT DISTINCT ticker FROM event")]
+    span = (end_date - start_date).days
+
+    def random_timestamp() -> datetime.datetime:
+        return datetime.datetime.combine(start_date + datetime.timedelta(days=rng.randrange(max(1, span))), datetime.time(12, 0))
+
+    timestamps = [random_timestamp() for _ in range(samples)]
+    sample_tickers = [rng.choice(tickers) for _ in range(samples)]
+
+    results = {
+        "SqliteDB.get_events": measure_latency(
+            lambda ticker, timestamp: db.get_events(ticker=ticker, begin=[timestamp - datetime.timedelta(days=30), timestamp]),
+            list(zip(sample_tickers, timestamps))),
+        "SqliteDB.get_latest_event": measure_latency(
+            lambda ticker, timestamp: db.get_latest_event(ticker, EVENT_TYPE_OHLCV, timestamp),
+            list(zip(sample_tickers, timestamps))),
+    }
+
+    # brokerage calls are measured cold at each timestamp, the way a strategy sees them after the clock moves
+    historical_data = SQLHistoricalData(db)
+    brokerage = SimpleBrokerage(100000000, historical_data)
+    historical_data.update_timestamp(timestamps[0])
+    for ticker in tickers[:50]:
+        brokerage.place_buy_trade(ticker, 10)
+
+    def get_ticker_price(ticker: str, timestamp: datetime.datetime):
+        historical_data.update_timestamp(timestamp)
+        brokerage.get_ticker_price(ticker)
+
+    def get_brokerage_value(timestamp: datetime.datetime):
+        historical_data.update_timestamp(timestamp)
+        brokerage.get_brokerage_value()
+
+    results["SimpleBrokerage.get_ticker_price"] = measure_latency(get_ticker_price, list(zip(sample_tickers, timestamps)))
+    results["SimpleBrokerage.get_brokerage_value"] = measure_latency(get_brokerage_value, [(timestamp,) for timestamp in timestamps[:max(1, samples // 10)]])
+    results["SimpleBrokerage.get_brokerage_value"]["positions"] = len(brokerage.get_positions())
+
+    return results
+
+def run_benchmarks(db_path: str, start_date: datetime.date, end_date: datetime.date, samples: int = 200) -> dict:
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "db_path": db_path,
+        "db_bytes": os.path.getsize(db_path),
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "backtest": {
+            "per_day": benchmark_backtest(db_path, start_date, end_date, stream=False),
+            "streaming": benchmark_backtest(db_path, start_date, end_date, stream=True),
+            "prefetching": benchmark_backtest(db_path, start_date, end_date, stream=True, prefetch_depth=4),
+        },
+        "latency": benchmark_latencies(db_path, start_date, end_date, samples),
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark simply_backtest against an event database")
+    parser.add_argument("--db", help="existing event database; a synthetic one is generated when omitted")
+    parser.add_argument("--start-date", type=datetime.date.fromisoformat, default=datetime.date(2020, 1, 1))
+    parser.add_argument("--end-date", type=datetime.date.fromisoformat, default=datetime.date(2020, 12, 31))
+    parser.add_argument("--tickers", type=int, default=100)
+    parser.add_argument("--bar-minutes", type=int, default=390)
+    parser.add_argument("--dividends-per-year", type=int, default=4)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = args.db
+        if db_path is None:
+            db_path = os.path.join(directory, "synthetic.sqlite")
+            years = args.end_date.year - args.start_date.year + 1
+            generate_event_database(db_path, args.tickers, args.start_date, years, args.bar_minutes, args.dividends_per_year)
+
+        results = run_benchmarks(db_path, args.start_date, args.end_date, args.samples)
+
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+
+    print(json.dumps(results, indent=2))
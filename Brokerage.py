@@ -1,7 +1,16 @@
 from abc import ABC, abstractmethod
+import bisect
+from collections import deque
 import datetime
-from DB import DividendAnnouncement, ExDividend, DividendPayment, Event, OHLCV
+import heapq
+import math
+from typing import Sequence
+import numpy as np
+from DB import EVENT_TYPE_EX_DIVIDEND, EVENT_TYPE_OHLCV, DividendAnnouncement, ExDividend, DividendPayment, Event, OHLCV, filter_events, to_datetime
 from HistoricalData import HistoricalData
+from RollSpread import RollSpreadEstimator
+
+SPREAD_LOOKBACK = datetime.timedelta(days=30)
 
 class Position:
     def __init__(self, symbol: str, quantity: int, buy_price: int):
@@ -16,12 +25,206 @@ class PNL:
         self.unit_buy_price = unit_buy_price
         self.unit_sell_price = unit_sell_price
 
+ORDER_SIDE_BUY = "BUY"
+ORDER_SIDE_SELL = "SELL"
+
+ORDER_TYPE_MARKET = "MARKET"
+ORDER_TYPE_LIMIT = "LIMIT"
+ORDER_TYPE_STOP = "STOP"
+
+ORDER_STATUS_OPEN = "OPEN"
+ORDER_STATUS_FILLED = "FILLED"
+ORDER_STATUS_REJECTED = "REJECTED"
+ORDER_STATUS_CANCELLED = "CANCELLED"
+
+class Order:
+    # price is the limit or stop price and is unused for market orders. Once filled, result holds the
+    # Position of a buy or the PNLs of a sell
+    def __init__(self, symbol: str, quantity: int, side: str, order_type: str = ORDER_TYPE_MARKET, price: float | None = None):
+        if order_type != ORDER_TYPE_MARKET and price is None:
+            raise ValueError(f"{order_type} orders need a price")
+
+        self.symbol = symbol
+        self.quantity = quantity
+        self.side = side
+        self.order_type = order_type
+        self.price = price
+        self.id = None
+        self.status = ORDER_STATUS_OPEN
+        self.fill_price = None
+        self.result = None
+
+def _order_key(order: Order) -> tuple[float, int]:
+    return order.price, order.id
+
+class OrderBook:
+    # resting limit and stop orders, per ticker and per (side, type) in lists sorted by (price, id). Every kind
+    # triggers on one side of the bar's range, so the triggered orders of a bar are a prefix or suffix found by bisection:
+    # buy limits at or above the low, sell limits at or below the high, buy stops at or below the high, sell stops at or above the low
+    _books: dict[str, dict[tuple[str, str], list[Order]]]
+    _next_id: int
+
+    def __init__(self):
+        self._books = {}
+        self._next_id = 0
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self._books
+
+    def assign_id(self, order: Order):
+        order.id = self._next_id
+        self._next_id += 1
+
+    def add(self, order: Order):
+        orders = self._books.setdefault(order.symbol, {}).setdefault((order.side, order.order_type), [])
+        bisect.insort(orders, order, key=_order_key)
+
+    def remove(self, order: Order) -> bool:
+        orders = self._books.get(order.symbol, {}).get((order.side, order.order_type))
+        if orders is None:
+            return False
+
+        index = bisect.bisect_left(orders, _order_key(order), key=_order_key)
+        if index == len(orders) or orders[index] is not order:
+            return False
+
+        del orders[index]
+        self._drop_empty(order.symbol)
+        return True
+
+    def trigger(self, ticker: str, low: float, high: float) -> list[Order]:
+        # removes and returns the orders a bar spanning [low, high] triggers, oldest first
+        book = self._books.get(ticker)
+        if book is None:
+            return []
+
+        triggered = []
+        for (side, order_type), orders in book.items():
+            if (side == ORDER_SIDE_BUY) == (order_type == ORDER_TYPE_LIMIT):
+                first = bisect.bisect_left(orders, (low,), key=_order_key)
+                triggered.extend(orders[first:])
+                del orders[first:]
+            else:
+                last = bisect.bisect_right(orders, (high, math.inf), key=_order_key)
+                triggered.extend(orders[:last])
+                del orders[:last]
+
+        self._drop_empty(ticker)
+        triggered.sort(key=lambda order: order.id)
+        return triggered
+
+    def get_orders(self) -> list[Order]:
+        return sorted((order for book in self._books.values() for orders in book.values() for order in orders), key=lambda order: order.id)
+
+    def _drop_empty(self, ticker: str):
+        book = self._books[ticker]
+        for kind in [kind for kind, orders in book.items() if len(orders) == 0]:
+            del book[kind]
+        if len(book) == 0:
+            del self._books[ticker]
+
 class PendingDividend:
     def __init__(self, ticker: str, amount: int, payment_date: datetime.date):
         self.ticker = ticker
         self.amount = amount
         self.payment_date = payment_date
 
+class Ledger:
+    # positions as per-ticker FIFO lot queues with cached quantities, pending dividends as a heap keyed by
+    # payment date, and a market value that is only adjusted for tickers whose mark changes
+    _lots: dict[str, deque[Position]]
+    _quantities: dict[str, int]
+    _marks: dict[str, float]
+    _market_value: float
+    _pending_dividends: list[tuple[datetime.date, int, PendingDividend]]
+    _dividend_sequence: int
+    _positions: list[Position] | None
+
+    def __init__(self):
+        self._lots = {}
+        self._quantities = {}
+        self._marks = {}
+        self._market_value = 0
+        self._pending_dividends = []
+        self._dividend_sequence = 0
+        self._positions = None
+
+    def add_lot(self, position: Position):
+        self._lots.setdefault(position.symbol, deque()).append(position)
+        self._quantities[position.symbol] = self._quantities.get(position.symbol, 0) + position.quantity
+        self._market_value += self._marks.get(position.symbol, 0) * position.quantity
+        self._positions = None
+
+    def reduce(self, symbol: str, quantity: int) -> list[tuple[int, int]] | None:
+        # consume lots oldest first, returning (buy_price, quantity) for each lot touched
+        if quantity > self._quantities.get(symbol, 0):
+            return None
+        if quantity == 0:
+            return []
+
+        lots = self._lots[symbol]
+        removed: list[tuple[int, int]] = []
+        remaining = quantity
+        while remaining > 0:
+            lot = lots[0]
+            if lot.quantity > remaining:
+                lot.quantity -= remaining
+                removed.append((lot.buy_price, remaining))
+                remaining = 0
+            else:
+                lots.popleft()
+                removed.append((lot.buy_price, lot.quantity))
+                remaining -= lot.quantity
+
+        self._quantities[symbol] -= quantity
+        self._market_value -= self._marks.get(symbol, 0) * quantity
+        if self._quantities[symbol] == 0:
+            del self._lots[symbol]
+            del self._quantities[symbol]
+            self._marks.pop(symbol, None)
+
+        self._positions = None
+        return removed
+
+    def get_quantity(self, symbol: str) -> int:
+        return self._quantities.get(symbol, 0)
+
+    def get_quantities(self) -> dict[str, int]:
+        return self._quantities
+
+    def get_positions(self) -> list[Position]:
+        if self._positions is None:
+            self._positions = [lot for lots in self._lots.values() for lot in lots]
+        return self._positions
+
+    def mark(self, symbol: str, unit_value: float):
+        quantity = self._quantities.get(symbol, 0)
+        if quantity == 0:
+            return
+
+        self._market_value += (unit_value - self._marks.get(symbol, 0)) * quantity
+        self._marks[symbol] = unit_value
+
+    def get_market_value(self) -> float:
+        return self._market_value
+
+    def get_position_values(self) -> dict[str, float]:
+        return {symbol: quantity * self._marks.get(symbol, 0) for symbol, quantity in self._quantities.items()}
+
+    def add_pending_dividend(self, pending_dividend: PendingDividend):
+        payment_date = to_datetime(pending_dividend.payment_date).date()
+        heapq.heappush(self._pending_dividends, (payment_date, self._dividend_sequence, pending_dividend))
+        self._dividend_sequence += 1
+
+    def pop_due_dividends(self, day: datetime.date) -> list[PendingDividend]:
+        due = []
+        while len(self._pending_dividends) > 0 and self._pending_dividends[0][0] <= day:
+            due.append(heapq.heappop(self._pending_dividends)[2])
+        return due
+
+    def get_pending_dividends(self) -> list[PendingDividend]:
+        return [pending_dividend for _, _, pending_dividend in sorted(self._pending_dividends)]
+
 class Brokerage(ABC):
     _historical_data: HistoricalData
     _positions: list[Position]
@@ -66,47 +269,166 @@ class Brokerage(ABC):
     def handle_end_of_day(self, date: datetime.date):
         pass
 
+    def get_ticker_prices(self, tickers: Sequence[str]) -> np.ndarray:
+        # get_ticker_price for each ticker as an array of (bid, ask) rows aligned with tickers, NaN where there is no price
+        prices = np.full((len(tickers), 2), np.nan)
+        for index, ticker in enumerate(tickers):
+            price = self.get_ticker_price(ticker)
+            if price is not None:
+                prices[index] = price
+        return prices
+
+    def submit_orders(self, orders: Sequence[Order]) -> list[Order]:
+        # market orders only, each placed on its own; brokerages with an order book also take limit and stop orders
+        for order in orders:
+            if order.order_type != ORDER_TYPE_MARKET:
+                raise ValueError(f"{type(self).__name__} does not support {order.order_type} orders")
+
+            if order.side == ORDER_SIDE_BUY:
+                order.result = self.place_buy_trade(order.symbol, order.quantity)
+            else:
+                order.result = self.place_sell_trade(order.symbol, order.quantity)
+            order.status = ORDER_STATUS_REJECTED if order.result is None else ORDER_STATUS_FILLED
+        return list(orders)
+
+    def get_traded_value(self) -> float:
+        # cumulative cash value of every buy and sell
+        return 0
+
+    def get_dividend_income(self) -> dict[str, int]:
+        return {}
+
+    def get_position_values(self) -> dict[str, float]:
+        # market value of each held ticker at its latest mark
+        return {}
+
 class SimpleBrokerage(Brokerage):
     _cash: int
-    _positions: list[Position]
-    _pending_dividends: list[PendingDividend]
+    _ledger: Ledger
+    _pnls: list[PNL]
     _historical_data: HistoricalData
+    _spread_estimators: dict[str, RollSpreadEstimator]
+    _receiving_events: bool
+    _traded_value: float
+    _dividend_income: dict[str, int]
+    _order_book: OrderBook
     
     def __init__(self, cash: int, historical_data: HistoricalData):
         self._cash = cash
-        self._positions = []
-        self._pending_dividends = []
+        self._ledger = Ledger()
+        self._order_book = OrderBook()
+        self._pnls = []
+        self._traded_value = 0
+        self._dividend_income = {}
         self._historical_data = historical_data
+        self._spread_estimators = {}
+        self._receiving_events = False
+        historical_data.register_lookback(SPREAD_LOOKBACK)
 
     def get_cash(self):
         return self._cash
 
     def get_positions(self):
-        return self._positions
+        return self._ledger.get_positions()
     
     def place_buy_trade(self, symbol: str, quantity: int):
+        return self._execute_buy(symbol, quantity, self.get_ticker_price(symbol))
+
+    def place_sell_trade(self, symbol: str, quantity: int):
+        if self._ledger.get_quantity(symbol) < quantity:
+            return None
+        return self._execute_sell(symbol, quantity, self.get_ticker_price(symbol))
+
+    def submit_orders(self, orders: Sequence[Order]) -> list[Order]:
+        # market orders fill in submission order against one batched quote per ticker. Limit orders that are already
+        # marketable fill at the quote, the rest rest in the order book with the stop orders until a bar triggers them
+        market_symbols = sorted(set(order.symbol for order in orders if order.order_type == ORDER_TYPE_MARKET or order.order_type == ORDER_TYPE_LIMIT))
+        quotes = dict(zip(market_symbols, self.get_ticker_prices(market_symbols).tolist()))
+
+        for order in orders:
+            self._order_book.assign_id(order)
+            quote = quotes.get(order.symbol)
+            if order.order_type != ORDER_TYPE_MARKET and not (order.order_type == ORDER_TYPE_LIMIT and self._is_marketable(order, quote)):
+                self._order_book.add(order)
+                continue
+
+            if math.isnan(quote[0]):
+                order.status = ORDER_STATUS_REJECTED
+                continue
+
+            self._fill_order(order, tuple(quote))
+        return list(orders)
+
+    def cancel_order(self, order: Order) -> bool:
+        if not self._order_book.remove(order):
+            return False
+        order.status = ORDER_STATUS_CANCELLED
+        return True
+
+    def get_open_orders(self) -> list[Order]:
+        return self._order_book.get_orders()
+
+    def _is_marketable(self, order: Order, quote: list[float] | None) -> bool:
+        if quote is None or math.isnan(quote[0]):
+            return False
+        return quote[1] <= order.price if order.side == ORDER_SIDE_BUY else quote[0] >= order.price
+
+    def _fill_order(self, order: Order, quote: tuple[float, float]):
+        if order.side == ORDER_SIDE_BUY:
+            order.result = self._execute_buy(order.symbol, order.quantity, quote)
+            order.fill_price = quote[1]
+        else:
+            order.result = self._execute_sell(order.symbol, order.quantity, quote)
+            order.fill_price = quote[0]
+
+        if order.result is None:
+            order.status = ORDER_STATUS_REJECTED
+            order.fill_price = None
+        else:
+            order.status = ORDER_STATUS_FILLED
+
+    def _fill_triggered_order(self, order: Order, bar: OHLCV):
+        # a limit fills at its price, or at the open when the bar gapped through it. A stop becomes a market order at
+        # its price (or the open, on a gap) and pays the spread on top
+        spread = self._get_bid_ask_spread(order.symbol)
+        if order.order_type == ORDER_TYPE_LIMIT:
+            if order.side == ORDER_SIDE_BUY:
+                price = min(order.price, bar.open)
+                quote = (price - spread, price)
+            else:
+                price = max(order.price, bar.open)
+                quote = (price, price + spread)
+        else:
+            price = max(order.price, bar.open) if order.side == ORDER_SIDE_BUY else min(order.price, bar.open)
+            quote = (price - spread/2, price + spread/2)
+
+        self._fill_order(order, quote)
+
+    def _execute_buy(self, symbol: str, quantity: int, current_price: tuple[float, float]) -> Position | None:
         # make sure that at the current price they have enough money
-        current_price = self.get_ticker_price(symbol)
         cash_needed = current_price[1] * quantity
         if cash_needed > self.get_cash():
             return None
         
         self._cash -= cash_needed
+        self._traded_value += cash_needed
 
         position = Position(symbol, quantity, current_price)
 
-        self._positions.append(position)
+        self._ledger.add_lot(position)
+        self._ledger.mark(symbol, current_price[0])
         return position
 
-    def place_sell_trade(self, symbol: str, quantity: int):
+    def _execute_sell(self, symbol: str, quantity: int, current_price: tuple[float, float]) -> list[PNL] | None:
         # make sure that they have the position
-        reduced_positions = self._reduce_position(symbol, quantity)
+        reduced_positions = self._ledger.reduce(symbol, quantity)
         if reduced_positions is None:
             return None
         
-        current_price = self.get_ticker_price(symbol)
         cash_gained = current_price[0] * quantity
         self._cash += cash_gained
+        self._traded_value += cash_gained
+        self._ledger.mark(symbol, current_price[0])
         
         pnls = list(map(lambda x: PNL(symbol, x[1], x[0], current_price), reduced_positions))
         self._pnls.extend(pnls)
@@ -114,6 +436,15 @@ class SimpleBrokerage(Brokerage):
     
     def get_pnls(self):
         return self._pnls
+
+    def get_traded_value(self) -> float:
+        return self._traded_value
+
+    def get_dividend_income(self) -> dict[str, int]:
+        return self._dividend_income
+
+    def get_position_values(self) -> dict[str, float]:
+        return self._ledger.get_position_values()
     
     def get_ticker_price(self, ticker: str) -> tuple[int, int]:
         current_price = self._historical_data.get_current_price(ticker)
@@ -123,104 +454,108 @@ class SimpleBrokerage(Brokerage):
         
         bid_ask_spread = self._get_bid_ask_spread(ticker)
         return (current_price - bid_ask_spread/2, current_price + bid_ask_spread/2)
+
+    def get_ticker_prices(self, tickers: Sequence[str]) -> np.ndarray:
+        # one price lookup and one spread seeding query for the whole list
+        current_prices = self._historical_data.get_current_prices(tickers)
+        priced = ~np.isnan(current_prices)
+
+        spreads = np.zeros(len(tickers))
+        priced_tickers = [ticker for ticker, has_price in zip(tickers, priced) if has_price]
+        spreads_by_ticker = self.get_bid_ask_spreads(priced_tickers)
+        spreads[priced] = [spreads_by_ticker[ticker] for ticker in priced_tickers]
+
+        return np.column_stack([current_prices - spreads/2, current_prices + spreads/2])
+
+    def get_bid_ask_spreads(self, tickers: list[str]) -> dict[str, int]:
+        current_time = to_datetime(self._historical_data.get_timestamp())
+
+        # seed every cold ticker from a single window query instead of one per ticker
+        cold_tickers = set(ticker for ticker in tickers if self._needs_spread_seed(ticker, current_time))
+        if len(cold_tickers) > 0:
+            for ticker in cold_tickers:
+                self._spread_estimators[ticker] = RollSpreadEstimator()
+                self._spread_estimators[ticker].set_updated(current_time)
+
+            events_by_ticker = self._historical_data.get_events_many(sorted(cold_tickers), current_time - SPREAD_LOOKBACK, current_time)
+            for ticker, events in events_by_ticker.items():
+                for event in events:
+                    if isinstance(event, OHLCV):
+                        self._spread_estimators[ticker].add_bar(to_datetime(event.begin), event.close)
+
+        return {ticker: self._get_bid_ask_spread(ticker) for ticker in tickers}
     
     def deposit_cash(self, amount: int):
         self._cash += amount
 
-    def handle_events(self, events: list[Event]):
-        positions_by_ticker = {}
-        for position in self._positions:
-            if position.symbol not in positions_by_ticker:
-                positions_by_ticker[position.symbol] = []
-            positions_by_ticker[position.symbol].append(position)
-        
-        for event in events:
-            if isinstance(event, ExDividend):
-                if event.ticker in positions_by_ticker:
-                    total_quantity = sum(position.quantity for position in positions_by_ticker[event.ticker])
-                    print(f"You are entitled to {event.amount} per share of {event.ticker} for {total_quantity} shares on {event.payment_date}")
-                    self._add_pending_dividend(event.ticker, event.amount * total_quantity, event.payment_date)
+    def handle_events(self, events: Sequence[Event]):
+        self._receiving_events = True
+        held_quantities = self._ledger.get_quantities()
+
+        # only the bars and ex-dividends we care about get decoded
+        for event in filter_events(events, EVENT_TYPE_OHLCV, self._spread_estimators):
+            self._spread_estimators[event.ticker].add_bar(to_datetime(event.begin), event.close)
+
+        # resting orders are checked against each completed bar of their ticker
+        for event in filter_events(events, EVENT_TYPE_OHLCV, self._order_book):
+            for order in self._order_book.trigger(event.ticker, event.low, event.high):
+                self._fill_triggered_order(order, event)
+
+        # a new bar is the only thing that moves a held ticker's price, so that is when it gets re-marked
+        for ticker in set(event.ticker for event in filter_events(events, EVENT_TYPE_OHLCV, held_quantities)):
+            self._mark_to_market(ticker)
+
+        for event in filter_events(events, EVENT_TYPE_EX_DIVIDEND, held_quantities):
+            total_quantity = held_quantities[event.ticker]
+            print(f"You are entitled to {event.amount} per share of {event.ticker} for {total_quantity} shares on {event.payment_date}")
+            self._add_pending_dividend(event.ticker, event.amount * total_quantity, event.payment_date)
     
     def handle_end_of_day(self, date: datetime.date):
         self._handle_pending_dividends_for_day(date)
     
     def get_brokerage_value(self):
-        return self.get_cash() + sum(position.quantity * self.get_ticker_price(position.symbol)[0] for position in self._positions)
-
-    def _find_positions_with_symbol(self, symbol: str) -> list[Position]:
-        positions = []
-        for position in self._positions:
-            if position.symbol == symbol:
-                positions.append(position)
-        return positions
-    
-    def _add_position(self, position: Position):
-        self._positions.append(position)
-            
-    def _reduce_position(self, symbol: str, quantity: int):
-        positions = self._find_positions_with_symbol(symbol)
-        if len(positions) == 0:
-            return None
-        
-        total_quantity = sum(position.quantity for position in positions)
-        if total_quantity > quantity:
-            position_prices_removed: list[tuple[int, int]] = []
-
-            for position in positions:
-                if position.quantity > quantity:
-                    position.quantity -= quantity
-                    position_prices_removed.append((position.buy_price, quantity))
-                    return position_prices_removed
-                else:
-                    quantity -= position.quantity
-                    positions.remove(position)
-                    position_prices_removed.append((position.buy_price, position.quantity))
-
-            return position_prices_removed
-        else:
-            return None
-        
+        # without an event feed nothing re-marks positions as the clock moves, so price them all now
+        if not self._receiving_events:
+            for ticker in list(self._ledger.get_quantities()):
+                self._mark_to_market(ticker)
+
+        return self.get_cash() + self._ledger.get_market_value()
+
+    def _mark_to_market(self, ticker: str):
+        price = self.get_ticker_price(ticker)
+        if price is not None:
+            self._ledger.mark(ticker, price[0])
+
     def _get_bid_ask_spread(self, ticker: str) -> int:
-        # Get recent OHLCV data for the ticker
-        current_time = self._historical_data.get_timestamp()
-        if not isinstance(current_time, datetime.datetime):
-            return 0  # Invalid timestamp type
-            
-        lookback_period = datetime.timedelta(days=30)  # Use 30 days of data
-        start_time = current_time - lookback_period
-        
-        events = self._historical_data.get_events(ticker, start_time, current_time)
-        ohlcv_events = [event for event in events if isinstance(event, OHLCV)]
-        
-        if len(ohlcv_events) < 2:
-            return 0  # Not enough data to calculate spread
-            
-        # Calculate price changes using closing prices
-        price_changes = []
-        for i in range(1, len(ohlcv_events)):
-            price_change = ohlcv_events[i].close - ohlcv_events[i-1].close
-            price_changes.append(price_change)
-            
-        # Calculate serial covariance
-        if len(price_changes) < 2:
-            return 0
-            
-        mean_change = sum(price_changes) / len(price_changes)
-        covariance = sum((price_changes[i] - mean_change) * (price_changes[i-1] - mean_change) 
-                        for i in range(1, len(price_changes))) / (len(price_changes) - 1)
-        
-        # Apply Roll's formula: Spread = 2 * sqrt(-covariance)
-        if covariance >= 0:
-            return 0  # Invalid covariance, return 0 spread
-            
-        spread = int(2 * (-covariance) ** 0.5)
-        return spread
+        # Roll's estimator over the last 30 days of closes, maintained incrementally from handle_events
+        current_time = to_datetime(self._historical_data.get_timestamp())
+
+        if self._needs_spread_seed(ticker, current_time):
+            self._seed_spread_estimator(ticker, current_time)
+
+        estimator = self._spread_estimators[ticker]
+        estimator.evict_before(current_time - SPREAD_LOOKBACK)
+        estimator.set_updated(current_time)
+        return estimator.get_spread()
+
+    def _needs_spread_seed(self, ticker: str, current_time: datetime.datetime) -> bool:
+        # estimators only move forward; rewinding the clock means starting over from history
+        estimator = self._spread_estimators.get(ticker)
+        return estimator is None or current_time < estimator.get_updated()
+
+    def _seed_spread_estimator(self, ticker: str, current_time: datetime.datetime):
+        estimator = RollSpreadEstimator()
+        for event in self._historical_data.get_events(begin=current_time - SPREAD_LOOKBACK, end=current_time, ticker=ticker):
+            if isinstance(event, OHLCV):
+                estimator.add_bar(to_datetime(event.begin), event.close)
+
+        estimator.set_updated(current_time)
+        self._spread_estimators[ticker] = estimator
     
     def _add_pending_dividend(self, ticker: str, total_amount: int, payment_date: datetime.date):
-        self._pending_dividends.append(PendingDividend(ticker, total_amount, payment_date))
+        self._ledger.add_pending_dividend(PendingDividend(ticker, total_amount, payment_date))
 
     def _handle_pending_dividends_for_day(self, day: datetime.date):
-        for pending_dividend in self._pending_dividends:
-            if day >= pending_dividend.payment_date.date():
-                self._cash += pending_dividend.amount
-                self._pending_dividends.remove(pending_dividend)
\ No newline at end of file
+        for pending_dividend in self._ledger.pop_due_dividends(day):
+            self._cash += pending_dividend.amount
+            self._dividend_income[pending_dividend.ticker] = self._dividend_income.get(pending_dividend.ticker, 0) + pending_dividend.amount
@@ -1,9 +1,18 @@
 from abc import ABC, abstractmethod
-from datetime import datetime, date
+from contextlib import contextmanager
+import csv
+from datetime import datetime, date, time as dt_time, timedelta
 from enum import Enum
+import itertools
+import json
+import os
 from sqlite3 import Connection, Cursor
 import sqlite3
+import threading
 import time
+from urllib.request import pathname2url
+from typing import Callable, Container, Iterable, Iterator, Sequence
+from Resample import RESOLUTIONS, get_resolution_width, iterate_rollup_rows
 
 EVENT_TYPE_OHLCV = "OHLCV"
 EVENT_TYPE_DIVIDEND_ANNOUNCEMENT = "DIVIDEND_ANNOUNCEMENT"
@@ -31,7 +40,89 @@ EVENT_SELECT_ALL = """
             LEFT JOIN event dividend_payment ON da.dividend_payment_id = dividend_payment.id
         """
 
+# same columns as EVENT_SELECT_ALL, reading the dividend dates that SqliteDB.optimize() copies onto the dividend tables
+EVENT_SELECT_DENORMALIZED = """
+            SELECT 
+                e.id, e.type, e.begin, e.end, e.ticker, e.exchange,
+                o.open, o.high, o.low, o.close, o.volume,
+                da.amount as da_amount, da.ex_dividend_id, da.dividend_payment_id,
+                ed.amount as ed_amount, ed.dividend_payment_id as ed_payment_id,
+                dp.amount as dp_amount,
+                ear.eps as eps, ear.eps_estimate as eps_estimate, ear.number_of_estimates as number_of_estimates, ear.fiscal_quarter_ending as fiscal_quarter_ending,
+                da.ex_dividend_begin as ex_dividend_begin,
+                COALESCE(da.dividend_payment_begin, ed.dividend_payment_begin) as dividend_payment_begin
+            FROM event e
+            LEFT JOIN ohlcv o ON e.id = o.event_id
+            LEFT JOIN dividend_announcement da ON e.id = da.event_id
+            LEFT JOIN ex_dividend ed ON e.id = ed.event_id
+            LEFT JOIN dividend_payment dp ON e.id = dp.event_id
+            LEFT JOIN earnings ear ON e.id = ear.event_id
+        """
+
+# every date with at least one event, kept up to date by SqliteDB.ingest() and rebuilt by SqliteDB.optimize()
+TRADING_DAY_SCHEMA = "CREATE TABLE IF NOT EXISTS trading_day (date DATE PRIMARY KEY)"
+
+# the schema documented in the README
+EVENT_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS event (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT NOT NULL, begin DATETIME NOT NULL, end DATETIME NOT NULL, ticker TEXT NOT NULL, exchange TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS ohlcv (event_id INTEGER PRIMARY KEY REFERENCES event (id), open INTEGER NOT NULL, high INTEGER NOT NULL, low INTEGER NOT NULL, close INTEGER NOT NULL, volume INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS dividend_announcement (event_id INTEGER PRIMARY KEY REFERENCES event (id), ex_dividend_id INTEGER, dividend_payment_id INTEGER, amount INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS ex_dividend (event_id INTEGER PRIMARY KEY REFERENCES event (id), dividend_announcement_id INTEGER, dividend_payment_id INTEGER, amount INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS dividend_payment (event_id INTEGER PRIMARY KEY REFERENCES event (id), dividend_announcement_id INTEGER, ex_dividend_id INTEGER, amount INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS earnings (event_id INTEGER PRIMARY KEY REFERENCES event (id), eps INTEGER NOT NULL, eps_estimate INTEGER, number_of_estimates INTEGER NOT NULL, fiscal_quarter_ending DATE NOT NULL)",
+    TRADING_DAY_SCHEMA,
+]
+
+# OHLCV bars rolled up per ticker to the resolutions in Resample.RESOLUTIONS, built by SqliteDB.build_rollups() and kept up
+# to date by SqliteDB.ingest(). Timestamps are epoch microseconds
+ROLLUP_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS ohlcv_rollup (resolution TEXT NOT NULL, ticker TEXT NOT NULL, begin_epoch INTEGER NOT NULL, end_epoch INTEGER NOT NULL, exchange TEXT NOT NULL, open INTEGER NOT NULL, high INTEGER NOT NULL, low INTEGER NOT NULL, close INTEGER NOT NULL, volume INTEGER NOT NULL, PRIMARY KEY (resolution, ticker, begin_epoch)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS ohlcv_rollup_resolution_begin ON ohlcv_rollup (resolution, begin_epoch)",
+]
+
+OPTIMIZE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS event_ticker_type_begin ON event (ticker, type, begin)",
+    "CREATE INDEX IF NOT EXISTS event_begin ON event (begin)",
+]
+
+# prepared statements kept per connection: the 16 get_events and 8 get_latest_event templates plus the streaming,
+# bulk-loading and lookup queries, with room for a few IN-list lengths
+STATEMENT_CACHE_SIZE = 64
+
+READ_PRAGMAS = [
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA query_only = ON",
+]
+
+def to_datetime(value: datetime | date | str) -> datetime:
+    # sqlite hands DATETIME columns back as ISO strings unless they were bound as datetimes
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, dt_time(0, 0, 0))
+    return datetime.fromisoformat(value)
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+def to_epoch(value: datetime | date | str) -> int:
+    # microseconds since the unix epoch, treating naive timestamps as they are stored
+    return (to_datetime(value) - EPOCH) // MICROSECOND
+
+def from_epoch(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=int(value))
+
+def _resolve_lazy(value):
+    # rarely read fields are stored raw (ISO strings, or a loader for values that need another query) and decoded on first access
+    if callable(value):
+        value = value()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
 class Event(ABC):
+    __slots__ = ("begin", "end", "ticker", "exchange")
     begin: datetime
     end: datetime
     ticker: str
@@ -44,6 +135,7 @@ class Event(ABC):
         self.exchange = exchange
 
 class OHLCV(Event):
+    __slots__ = ("open", "high", "low", "close", "volume")
     open: datetime
     high: datetime
     low: int
@@ -59,28 +151,56 @@ class OHLCV(Event):
         self.volume = volume
 
 class DividendAnnouncement(Event):
+    __slots__ = ("amount", "_exDividend", "_payment")
     amount: int
-    exDividend: datetime.date
-    payment: datetime.date
 
     def __init__(self, begin: datetime, end: datetime, ticker: str, exchange: str, amount: int, exDividend: datetime.date, payment: datetime.date):
         super().__init__(begin, end, ticker, exchange)
         self.amount = amount
-        self.exDividend = exDividend
-        self.payment = payment
+        self._exDividend = exDividend
+        self._payment = payment
+
+    @property
+    def exDividend(self) -> datetime.date:
+        self._exDividend = _resolve_lazy(self._exDividend)
+        return self._exDividend
+
+    @property
+    def payment(self) -> datetime.date:
+        self._payment = _resolve_lazy(self._payment)
+        return self._payment
+
+    def __getstate__(self):
+        # loaders can't be pickled, so lazy fields are resolved first
+        self.exDividend, self.payment
+        return None, {name: getattr(self, name) for name in Event.__slots__ + DividendAnnouncement.__slots__}
 
 class ExDividend(Event):
+    __slots__ = ("amount", "_exDividend", "_payment_date")
     amount: int
-    exDividend: datetime.date
-    payment_date: datetime.date
 
     def __init__(self, begin: datetime, end: datetime, ticker: str, exchange: str, amount: int, exDividend: datetime.date, payment_date: datetime.date):
         super().__init__(begin, end, ticker, exchange)
         self.amount = amount
-        self.exDividend = exDividend
-        self.payment_date = payment_date
+        self._exDividend = exDividend
+        self._payment_date = payment_date
+
+    @property
+    def exDividend(self) -> datetime.date:
+        self._exDividend = _resolve_lazy(self._exDividend)
+        return self._exDividend
+
+    @property
+    def payment_date(self) -> datetime.date:
+        self._payment_date = _resolve_lazy(self._payment_date)
+        return self._payment_date
+
+    def __getstate__(self):
+        self.exDividend, self.payment_date
+        return None, {name: getattr(self, name) for name in Event.__slots__ + ExDividend.__slots__}
 
 class DividendPayment(Event):
+    __slots__ = ("amount",)
     amount: int
 
     def __init__(self, begin: datetime, end: datetime, ticker: str, exchange: str, amount: int):
@@ -88,10 +208,12 @@ class DividendPayment(Event):
         self.amount = amount
 
 class Earnings(Event):
+    __slots__ = ("eps", "eps_estimate", "number_of_estimates", "fiscal_quarter_ending")
     eps: float
     eps_estimate: float | None
     number_of_estimates: int
-    fiscal_quarter_ending: datetime.date
+    # the ISO date as stored
+    fiscal_quarter_ending: str
 
     def __init__(self, begin: datetime, end: datetime, ticker: str, exchange: str, eps: float, eps_estimate: float, number_of_estimates: int, fiscal_quarter_ending: str):
         super().__init__(begin, end, ticker, exchange)
@@ -100,6 +222,69 @@ class Earnings(Event):
         self.number_of_estimates = number_of_estimates
         self.fiscal_quarter_ending = fiscal_quarter_ending
 
+    @property
+    def fiscal_quarter_ending_date(self) -> date:
+        return to_datetime(self.fiscal_quarter_ending).date()
+
+EVENT_CLASSES = {
+    EVENT_TYPE_OHLCV: OHLCV,
+    EVENT_TYPE_DIVIDEND_ANNOUNCEMENT: DividendAnnouncement,
+    EVENT_TYPE_EX_DIVIDEND: ExDividend,
+    EVENT_TYPE_DIVIDEND_PAYMENT: DividendPayment,
+    EVENT_TYPE_EARNINGS: Earnings,
+}
+
+class EventBatch(Sequence):
+    # the events sharing one begin, kept as raw joined rows; an event is decoded the first time it is read,
+    # and type/ticker can be inspected without decoding anything
+    __slots__ = ("_rows", "_events", "_decode")
+    _rows: list[tuple]
+    _events: list[Event | None]
+    _decode: Callable[[tuple], Event]
+
+    def __init__(self, rows: list[tuple], decode: Callable[[tuple], Event]):
+        self._rows = rows
+        self._events = [None] * len(rows)
+        self._decode = decode
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __getitem__(self, index: int) -> Event:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._rows)))]
+
+        event = self._events[index]
+        if event is None:
+            event = self._decode(self._rows[index])
+            self._events[index] = event
+        return event
+
+    def decode(self) -> "EventBatch":
+        # decode every event now rather than on first read
+        for index in range(len(self._rows)):
+            self[index]
+        return self
+
+    def get_type(self, index: int) -> str:
+        return self._rows[index][1]
+
+    def get_ticker(self, index: int) -> str:
+        return self._rows[index][4]
+
+    def filter(self, event_type: str | None, tickers: Container[str] | None = None) -> Iterator[Event]:
+        for index, row in enumerate(self._rows):
+            if (event_type is None or row[1] == event_type) and (tickers is None or row[4] in tickers):
+                yield self[index]
+
+def filter_events(events: Sequence[Event], event_type: str | None, tickers: Container[str] | None = None) -> Iterator[Event]:
+    # only decodes the matching events when given an EventBatch; event_type None matches every type
+    if isinstance(events, EventBatch):
+        return events.filter(event_type, tickers)
+
+    event_class = Event if event_type is None else EVENT_CLASSES[event_type]
+    return (event for event in events if isinstance(event, event_class) and (tickers is None or event.ticker in tickers))
+
 class DB(ABC):
     @abstractmethod
     def get_events(self, ticker: str | None = None, begin: tuple[datetime, datetime] | None = None, end: tuple[datetime, datetime] | None = None):
@@ -110,72 +295,412 @@ class DB(ABC):
         pass
 
 class SqliteDB(DB):
-    db_connection: Connection
+    # reads go through one read-only connection per thread, opened on the thread's first query, so a SqliteDB
+    # can be shared by threads. Every filter combination has a fixed query template so statements are prepared once
+    path: str
+    _event_select: str
+    _has_epoch_columns: bool
+    _has_trading_calendar: bool
+    _get_events_queries: dict[tuple[bool, bool, bool, bool], str]
+    _get_latest_event_queries: dict[tuple[bool, bool, bool], str]
+    _connections: dict[threading.Thread, Connection]
+    _connections_lock: threading.Lock
+    _trace_callback: Callable[[str], None] | None
 
     def __init__(self, path: str):
-        self.db_connection = sqlite3.connect(path)
+        self.path = path
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+        self._trace_callback = None
 
-    def get_events(self, ticker: str | None = None, event_type: str | None = None, begin: tuple[datetime, datetime] | None = None, end: tuple[datetime, datetime] | None = None) -> list[Event]:
-        cursor = self.db_connection.cursor()
+        self._detect_schema()
 
-        select = EVENT_SELECT_ALL
-        where: list[str] = []
+    def __getstate__(self):
+        # connections belong to one thread of one process, so a pickled SqliteDB is just its path and reconnects on load
+        return {"path": self.path}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state["path"])
+
+    @property
+    def db_connection(self) -> Connection:
+        thread = threading.current_thread()
+        connection = self._connections.get(thread)
+        if connection is None:
+            connection = self._open_read_connection(thread)
+        return connection
+
+    def set_trace_callback(self, callback: Callable[[str], None] | None):
+        # installed on every pooled connection, including those threads open later; None removes it
+        with self._connections_lock:
+            self._trace_callback = callback
+            for connection in self._connections.values():
+                connection.set_trace_callback(callback)
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections = {}
+
+    def optimize(self) -> dict[str, tuple[list[str], list[str]]]:
+        # migrate the schema for reads and return the query plans of the hot queries before and after
+        plans_before = self._get_query_plans()
+
+        with self._writable() as connection:
+            cursor = connection.cursor()
+
+            self._add_column_if_missing(cursor, "event", "begin_epoch", "INTEGER")
+            self._add_column_if_missing(cursor, "event", "end_epoch", "INTEGER")
+            connection.create_function("to_epoch", 1, to_epoch, deterministic=True)
+            cursor.execute("UPDATE event SET begin_epoch = to_epoch(begin), end_epoch = to_epoch(end)")
+
+            # copy the referenced dates onto the dividend rows so decoding needs no extra lookups
+            self._add_column_if_missing(cursor, "dividend_announcement", "ex_dividend_begin", "DATETIME")
+            self._add_column_if_missing(cursor, "dividend_announcement", "dividend_payment_begin", "DATETIME")
+            self._add_column_if_missing(cursor, "ex_dividend", "dividend_payment_begin", "DATETIME")
+            cursor.execute("""
+                UPDATE dividend_announcement SET
+                    ex_dividend_begin = (SELECT begin FROM event WHERE id = dividend_announcement.ex_dividend_id),
+                    dividend_payment_begin = (SELECT begin FROM event WHERE id = dividend_announcement.dividend_payment_id)
+            """)
+            cursor.execute("UPDATE ex_dividend SET dividend_payment_begin = (SELECT begin FROM event WHERE id = ex_dividend.dividend_payment_id)")
+
+            self._build_trading_calendar(connection)
+
+            for index in OPTIMIZE_INDEXES:
+                cursor.execute(index)
+            cursor.execute("ANALYZE")
+
+        self._detect_schema()
+        plans_after = self._get_query_plans()
+
+        return {name: (plans_before[name], plans_after[name]) for name in plans_before}
+
+    def ingest(self, records: Iterable[dict], default_type: str | None = None, defer_indexes: bool = True, skip_existing: bool = True) -> dict[str, int]:
+        # loads records in one transaction and returns the count written per type. Each record has type, begin, ticker
+        # and exchange (type falls back to default_type, end to begin) plus, by type:
+        #   OHLCV: end, open, high, low, close, volume
+        #   DIVIDEND: amount, ex_dividend, payment; begin is the announcement and the three linked events are written
+        #   EARNINGS: eps, eps_estimate (may be empty), number_of_estimates, fiscal_quarter_ending
+        # defer_indexes drops the indexes on event for the load and rebuilds them afterwards. skip_existing skips records
+        # at or before the latest event already stored for the same ticker and type, so overlapping files append cleanly
+        counts: dict[str, int] = {}
+
+        with self._writable() as connection:
+            indexes = []
+            if defer_indexes:
+                indexes = connection.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'event' AND sql IS NOT NULL").fetchall()
+                for name, _ in indexes:
+                    connection.execute(f"DROP INDEX {name}")
+
+            # databases from before the calendar existed get it built from their events; the writer adds the new days
+            if "date" not in self._get_columns("trading_day", connection):
+                self._build_trading_calendar(connection)
+
+            latest = {}
+            if skip_existing:
+                rows = connection.execute("SELECT ticker, type, MAX(begin) FROM event GROUP BY ticker, type")
+                latest = {(ticker, type): to_datetime(begin) for ticker, type, begin in rows}
+
+            writer = EventWriter(connection)
+            for record in records:
+                record_type = record.get("type") or default_type
+                begin = to_datetime(record["begin"])
+                end = to_datetime(record.get("end") or record["begin"])
+                ticker = record["ticker"]
+                exchange = record["exchange"]
+
+                stored_type = EVENT_TYPE_DIVIDEND_ANNOUNCEMENT if record_type == "DIVIDEND" else record_type
+                if (ticker, stored_type) in latest and begin <= latest[(ticker, stored_type)]:
+                    counts["skipped"] = counts.get("skipped", 0) + 1
+                    continue
+
+                match record_type:
+                    case 'OHLCV':
+                        writer.add_ohlcv(begin, end, ticker, exchange, int(record["open"]), int(record["high"]), int(record["low"]),
+                                         int(record["close"]), int(record["volume"]))
+                    case 'DIVIDEND':
+                        writer.add_dividend(ticker, exchange, begin, record["ex_dividend"], record["payment"], int(record["amount"]))
+                    case 'EARNINGS':
+                        writer.add_earnings(begin, end, ticker, exchange, int(record["eps"]), _optional_int(record.get("eps_estimate")),
+                                            int(record["number_of_estimates"]), record["fiscal_quarter_ending"])
+                    case _:
+                        raise ValueError(f"Unsupported record type {record_type}")
+
+                counts[record_type] = counts.get(record_type, 0) + 1
+
+            writer.flush()
+
+            for _, sql in indexes:
+                connection.execute(sql)
+            if len(indexes) > 0:
+                connection.execute("ANALYZE")
+
+            # records older than the stored data can land in buckets that are already rolled up, so those rebuild
+            if len(self._rollup_resolutions) > 0 and counts.get(EVENT_TYPE_OHLCV, 0) > 0:
+                self._update_rollups(connection, sorted(self._rollup_resolutions), rebuild=not skip_existing)
+
+        self._detect_schema()
+        return counts
+
+    def build_rollups(self, resolutions: Sequence[str] | None = None, rebuild: bool = False) -> dict[str, int]:
+        # rolls OHLCV bars up into ohlcv_rollup, by default for the resolutions already there, and returns the rows written
+        # per resolution. Each ticker picks up from its last stored bucket, which may have been partial, unless rebuilding
+        if resolutions is None:
+            resolutions = sorted(self._rollup_resolutions)
+        for resolution in resolutions:
+            get_resolution_width(resolution)
+
+        with self._writable() as connection:
+            for statement in ROLLUP_SCHEMA:
+                connection.execute(statement)
+            counts = self._update_rollups(connection, resolutions, rebuild)
+
+        self._detect_schema()
+        return counts
+
+    def has_rollup(self, resolution: str) -> bool:
+        return resolution in self._rollup_resolutions
+
+    def get_rollup_bars(self, resolution: str, ticker: str | None = None, begin: tuple[datetime, datetime] | None = None,
+                        visible_at: datetime | None = None) -> list[OHLCV]:
+        # rolled-up bars with begin in the begin range, leaving out any that haven't ended by visible_at
+        where: list[str] = ["resolution = ?"]
+        params: list = [resolution]
+
+        if ticker is not None:
+            where.append("ticker = ?")
+            params.append(ticker)
+
+        if begin is not None:
+            where.append("begin_epoch >= ? AND begin_epoch <= ?")
+            params.append(to_epoch(begin[0]))
+            params.append(to_epoch(begin[1]))
+
+        if visible_at is not None:
+            where.append("end_epoch <= ?")
+            params.append(to_epoch(visible_at))
+
+        select = "SELECT ticker, exchange, begin_epoch, end_epoch, open, high, low, close, volume FROM ohlcv_rollup"
+        rows = self.db_connection.execute(self._construct_query(select, where, "ORDER BY begin_epoch ASC, ticker ASC"), params)
+        return [OHLCV(from_epoch(begin), from_epoch(end), ticker, exchange, open, high, low, close, volume)
+                for ticker, exchange, begin, end, open, high, low, close, volume in rows]
+
+    def _update_rollups(self, connection: Connection, resolutions: Sequence[str], rebuild: bool) -> dict[str, int]:
+        counts = {resolution: 0 for resolution in resolutions}
+        if len(resolutions) == 0:
+            return counts
+
+        since: dict[tuple[str, str], int] = {}
+        for resolution in resolutions:
+            if rebuild:
+                connection.execute("DELETE FROM ohlcv_rollup WHERE resolution = ?", [resolution])
+                continue
+
+            rows = connection.execute("SELECT ticker, MAX(begin_epoch) FROM ohlcv_rollup WHERE resolution = ? GROUP BY ticker", [resolution])
+            since.update(((resolution, ticker), begin) for ticker, begin in rows)
+
+        # only bars from the earliest bucket that needs redoing are read, unless some ticker has never been rolled up
+        tickers = [row[0] for row in connection.execute("SELECT DISTINCT ticker FROM event WHERE type = ?", [EVENT_TYPE_OHLCV])]
+        begin = None
+        if all((resolution, ticker) in since for resolution in resolutions for ticker in tickers) and len(since) > 0:
+            begin = [from_epoch(min(since.values())), datetime.max]
+
+        rows = (row for chunk in self.iterate_ohlcv_row_chunks(begin=begin, connection=connection) for row in chunk)
+        for resolution, rollup_rows in iterate_rollup_rows(rows, resolutions, since):
+            connection.executemany("INSERT OR REPLACE INTO ohlcv_rollup (ticker, exchange, begin_epoch, end_epoch, open, high, low, close, volume, resolution) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [row + (resolution,) for row in rollup_rows])
+            counts[resolution] += len(rollup_rows)
+
+        return counts
+
+    def get_events(self, ticker: str | None = None, event_type: str | None = None, begin: tuple[datetime, datetime] | None = None, end: tuple[datetime, datetime] | None = None) -> list[Event]:
         params: list[str] = []
 
         if ticker is not None:
-            where.append("e.ticker = ?")
             params.append(ticker)
 
         if event_type is not None:
-            where.append("e.type = ?")
             params.append(event_type)
 
         if begin is not None:
-            where.append("e.begin >= ? AND e.begin <= ?")
             params.append(begin[0])
             params.append(begin[1])
 
         if end is not None:
-            where.append("e.end >= ? AND e.end <= ?")
             params.append(end[0])
             params.append(end[1])
 
-        query = self._construct_query(select, where, "ORDER BY e.begin ASC")
-        
-        cursor.execute(query, params)
-
-        results = cursor.fetchall()
+        query = self._get_events_queries[(ticker is not None, event_type is not None, begin is not None, end is not None)]
+        results = self.db_connection.execute(query, params).fetchall()
         events = list(map(lambda db_row: self.sql_to_event_from_joined_row(db_row), results))
 
         return events
 
-    def get_latest_event(self, ticker: str | None = None, type: str | None = None, current_timestamp: datetime | None = None) -> Event | None:
+    def iterate_events(self, begin: tuple[datetime, datetime] | None = None, chunk_size: int = 10000) -> Iterator[Event]:
+        for row in self._iterate_rows(begin, chunk_size):
+            yield self.sql_to_event_from_joined_row(row)
+
+    def iterate_event_batches(self, begin: tuple[datetime, datetime] | None = None, chunk_size: int = 10000) -> Iterator[EventBatch]:
+        # consecutive rows with the same begin, left undecoded until read
+        decode = self.sql_to_event_from_joined_row
+        rows: list[tuple] = []
+        for row in self._iterate_rows(begin, chunk_size):
+            if len(rows) > 0 and row[2] != rows[0][2]:
+                yield EventBatch(rows, decode)
+                rows = []
+            rows.append(row)
+
+        if len(rows) > 0:
+            yield EventBatch(rows, decode)
+
+    def _iterate_rows(self, begin: tuple[datetime, datetime] | None, chunk_size: int) -> Iterator[tuple]:
+        # one ordered cursor over the whole range, pulled in chunks so memory is bounded by chunk_size
         cursor = self.db_connection.cursor()
 
-        select = EVENT_SELECT_ALL
         where: list[str] = []
         params: list[str] = []
 
+        if begin is not None:
+            where.append("e.begin >= ? AND e.begin <= ?")
+            params.append(begin[0])
+            params.append(begin[1])
+
+        cursor.execute(self._construct_query(self._event_select, where, "ORDER BY e.begin ASC"), params)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if len(rows) == 0:
+                break
+
+            yield from rows
+
+    def get_ohlcv_rows(self, tickers: list[str] | None = None, begin: tuple[datetime, datetime] | None = None) -> list[tuple]:
+        # raw (ticker, exchange, begin, end, open, high, low, close, volume) rows for bulk loading, skipping the full join and Event decoding.
+        # begin and end come back as epoch microseconds
+        return [row for chunk in self.iterate_ohlcv_row_chunks(tickers, begin) for row in chunk]
+
+    def iterate_ohlcv_row_chunks(self, tickers: list[str] | None = None, begin: tuple[datetime, datetime] | None = None, chunk_size: int = 100000,
+                                 connection: Connection | None = None) -> Iterator[list[tuple]]:
+        # the rows of get_ohlcv_rows, ordered by ticker then begin, fetched chunk_size at a time
+        cursor = (self.db_connection if connection is None else connection).cursor()
+
+        timestamps = "e.begin_epoch, e.end_epoch" if self._has_epoch_columns else "e.begin, e.end"
+        select = f"""
+            SELECT e.ticker, e.exchange, {timestamps}, o.open, o.high, o.low, o.close, o.volume
+            FROM event e
+            JOIN ohlcv o ON e.id = o.event_id
+        """
+        where: list[str] = ["e.type = ?"]
+        params: list[str] = [EVENT_TYPE_OHLCV]
+
+        if tickers is not None:
+            where.append(f"e.ticker IN ({', '.join('?' for _ in tickers)})")
+            params.extend(tickers)
+
+        if begin is not None:
+            where.append("e.begin >= ? AND e.begin <= ?")
+            params.append(begin[0])
+            params.append(begin[1])
+
+        cursor.execute(self._construct_query(select, where, "ORDER BY e.ticker ASC, e.begin ASC"), params)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if len(rows) == 0:
+                break
+
+            if self._has_epoch_columns:
+                yield rows
+            else:
+                yield [(row[0], row[1], to_epoch(row[2]), to_epoch(row[3]), *row[4:]) for row in rows]
+
+    def get_latest_event(self, ticker: str | None = None, type: str | None = None, current_timestamp: datetime | None = None) -> Event | None:
+        params: list[str] = []
+
         if ticker is not None:
-            where.append("e.ticker = ?")
             params.append(ticker)
 
         if type is not None:
-            where.append("e.type = ?")
             params.append(type)
 
         if current_timestamp is not None:
-            where.append("e.begin <= ?")
             params.append(current_timestamp)
-        
-        cursor.execute(self._construct_query(select, where, "ORDER BY e.begin DESC LIMIT 1"), params)
 
-        result = cursor.fetchone()
+        query = self._get_latest_event_queries[(ticker is not None, type is not None, current_timestamp is not None)]
+        result = self.db_connection.execute(query, params).fetchone()
         if result is None:
             return None
 
         return self.sql_to_event_from_joined_row(result)
 
+    def get_latest_events(self, tickers: Sequence[str], type: str | None = None, current_timestamp: datetime | None = None) -> dict[str, Event]:
+        # get_latest_event for every ticker in one statement; tickers with no matching event are left out
+        if len(tickers) == 0:
+            return {}
+
+        filters = ["latest.ticker = tickers.column1"]
+        params: list = []
+        if type is not None:
+            filters.append("latest.type = ?")
+            params.append(type)
+        if current_timestamp is not None:
+            filters.append("latest.begin <= ?")
+            params.append(current_timestamp)
+
+        # the correlated subquery is one (ticker, type, begin) index probe per ticker
+        latest_ids = f"""
+            SELECT (SELECT latest.id FROM event latest WHERE {' AND '.join(filters)} ORDER BY latest.begin DESC LIMIT 1)
+            FROM (VALUES {', '.join('(?)' for _ in tickers)}) tickers
+        """
+        query = self._construct_query(self._event_select, [f"e.id IN ({latest_ids})"], "")
+        results = self.db_connection.execute(query, params + list(tickers)).fetchall()
+
+        events = map(self.sql_to_event_from_joined_row, results)
+        return {event.ticker: event for event in events}
+
+    def get_events_many(self, tickers: Sequence[str], event_type: str | None = None, begin: tuple[datetime, datetime] | None = None, end: tuple[datetime, datetime] | None = None) -> dict[str, list[Event]]:
+        # get_events for several tickers in one statement, grouped by ticker; every ticker gets a list, empty or not
+        events_by_ticker: dict[str, list[Event]] = {ticker: [] for ticker in tickers}
+        if len(tickers) == 0:
+            return events_by_ticker
+
+        where: list[str] = [f"e.ticker IN ({', '.join('?' for _ in tickers)})"]
+        params: list = list(tickers)
+
+        if event_type is not None:
+            where.append("e.type = ?")
+            params.append(event_type)
+
+        if begin is not None:
+            where.append("e.begin >= ? AND e.begin <= ?")
+            params.append(begin[0])
+            params.append(begin[1])
+
+        if end is not None:
+            where.append("e.end >= ? AND e.end <= ?")
+            params.append(end[0])
+            params.append(end[1])
+
+        results = self.db_connection.execute(self._construct_query(self._event_select, where, "ORDER BY e.begin ASC"), params).fetchall()
+        for row in results:
+            event = self.sql_to_event_from_joined_row(row)
+            events_by_ticker[event.ticker].append(event)
+
+        return events_by_ticker
+
+    def get_trading_days(self, begin: date, end: date) -> list[date]:
+        # dates in [begin, end] with at least one event, from the trading_day table when the database has one
+        if self._has_trading_calendar:
+            rows = self.db_connection.execute("SELECT date FROM trading_day WHERE date >= ? AND date <= ? ORDER BY date",
+                                              [begin.isoformat(), end.isoformat()])
+        else:
+            rows = self.db_connection.execute("SELECT DISTINCT date(begin) FROM event WHERE begin >= ? AND begin < ? ORDER BY 1",
+                                              [begin.isoformat(), (end + timedelta(days=1)).isoformat()])
+
+        return [date.fromisoformat(row[0]) for row in rows]
+
     def sql_to_event(self, cursor: Cursor, db_row: tuple[int, str, datetime, datetime, str, str]) -> Event:
         match db_row[1]:
             case 'OHLCV':
@@ -218,24 +743,16 @@ class SqliteDB(DB):
          ex_dividend_begin,
          dividend_payment_begin) = db_row
 
-        # Convert string dates to datetime objects if they exist
-        if ex_dividend_begin is not None:
-            ex_dividend_begin = datetime.fromisoformat(ex_dividend_begin)
-        if dividend_payment_begin is not None:
-            dividend_payment_begin = datetime.fromisoformat(dividend_payment_begin)
-
+        # dividend dates stay as ISO strings until read
         match type:
             case 'OHLCV':
                 return OHLCV(begin, end, ticker, exchange, open, high, low, close, volume)
             case 'DIVIDEND_ANNOUNCEMENT':
                 return DividendAnnouncement(begin, end, ticker, exchange, da_amount, ex_dividend_begin, dividend_payment_begin)
             case 'EX_DIVIDEND':
-                # we only store the id of the payment event on ex_dividend so to get the upcoming payment date we need to query on that
-                cursor = self.db_connection.cursor()
-                cursor.execute("SELECT begin FROM event WHERE id = ?", [ed_payment_id])
-                dividend_payment_begin = cursor.fetchone()[0]
-                if dividend_payment_begin is not None:
-                    dividend_payment_begin = datetime.fromisoformat(dividend_payment_begin)
+                # without the denormalized payment date we only have the id of the payment event, so look it up when it is first read
+                if dividend_payment_begin is None and ed_payment_id is not None:
+                    dividend_payment_begin = lambda: self._get_event_begin(ed_payment_id)
 
                 return ExDividend(begin, end, ticker, exchange, ed_amount, ex_dividend_begin, dividend_payment_begin)
             case 'DIVIDEND_PAYMENT':
@@ -243,7 +760,265 @@ class SqliteDB(DB):
             case 'EARNINGS':
                 return Earnings(begin, end, ticker, exchange, eps, eps_estimate, number_of_estimates, fiscal_quarter_ending)
 
+    def _get_event_begin(self, id: int) -> str | None:
+        row = self.db_connection.execute("SELECT begin FROM event WHERE id = ?", [id]).fetchone()
+        return None if row is None else row[0]
+
     def _construct_query(self, select: str, where: list[str], order_by: str) -> str:
         query = f"{select} { 'WHERE' if len(where) > 0 else '' } { ' AND '.join(where) } {order_by}"
 
         return query
+
+    def _detect_schema(self):
+        self._has_epoch_columns = "begin_epoch" in self._get_columns("event")
+        has_denormalized_dividends = "dividend_payment_begin" in self._get_columns("ex_dividend")
+        self._event_select = EVENT_SELECT_DENORMALIZED if has_denormalized_dividends else EVENT_SELECT_ALL
+        self._has_trading_calendar = "date" in self._get_columns("trading_day")
+        self._rollup_resolutions = set()
+        if "resolution" in self._get_columns("ohlcv_rollup"):
+            self._rollup_resolutions = set(resolution for resolution in RESOLUTIONS
+                                           if self.db_connection.execute("SELECT 1 FROM ohlcv_rollup WHERE resolution = ? LIMIT 1", [resolution]).fetchone() is not None)
+
+        # keyed by which of (ticker, type, begin, end) are filtered on
+        get_events_filters = ["e.ticker = ?", "e.type = ?", "e.begin >= ? AND e.begin <= ?", "e.end >= ? AND e.end <= ?"]
+        self._get_events_queries = {
+            used: self._construct_query(self._event_select, list(itertools.compress(get_events_filters, used)), "ORDER BY e.begin ASC")
+            for used in itertools.product([False, True], repeat=len(get_events_filters))
+        }
+
+        # keyed by which of (ticker, type, timestamp) are filtered on
+        get_latest_event_filters = ["e.ticker = ?", "e.type = ?", "e.begin <= ?"]
+        self._get_latest_event_queries = {
+            used: self._construct_query(self._event_select, list(itertools.compress(get_latest_event_filters, used)), "ORDER BY e.begin DESC LIMIT 1")
+            for used in itertools.product([False, True], repeat=len(get_latest_event_filters))
+        }
+
+    def _open_read_connection(self, thread: threading.Thread) -> Connection:
+        # mode=ro makes the connection read-only at the file level. Connections of threads that have exited are
+        # closed here, which is why they are opened without the same-thread check
+        uri = f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro"
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in READ_PRAGMAS:
+            connection.execute(pragma)
+
+        with self._connections_lock:
+            for finished in [other for other in self._connections if not other.is_alive()]:
+                self._connections.pop(finished).close()
+            connection.set_trace_callback(self._trace_callback)
+            self._connections[thread] = connection
+
+        return connection
+
+    def _build_trading_calendar(self, connection: Connection):
+        connection.execute(TRADING_DAY_SCHEMA)
+        connection.execute("INSERT OR IGNORE INTO trading_day (date) SELECT DISTINCT date(begin) FROM event")
+
+    def _get_columns(self, table: str, connection: Connection | None = None) -> set[str]:
+        connection = self.db_connection if connection is None else connection
+        return set(row[1] for row in connection.execute(f"PRAGMA table_info({table})"))
+
+    def _add_column_if_missing(self, cursor: Cursor, table: str, column: str, column_type: str):
+        if column not in self._get_columns(table, cursor.connection):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    @contextmanager
+    def _writable(self):
+        # the pooled connections are read-only, so writes go through a connection of their own, committed on success
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _get_query_plans(self) -> dict[str, list[str]]:
+        queries = {
+            "get_events(ticker, type, begin)": (
+                self._get_events_queries[(True, True, True, False)],
+                ["", EVENT_TYPE_OHLCV, "", ""],
+            ),
+            "get_latest_event(ticker, type, timestamp)": (
+                self._get_latest_event_queries[(True, True, True)],
+                ["", EVENT_TYPE_OHLCV, ""],
+            ),
+            "iterate_events(begin)": (
+                self._construct_query(self._event_select, ["e.begin >= ? AND e.begin <= ?"], "ORDER BY e.begin ASC"),
+                ["", ""],
+            ),
+        }
+
+        plans = {}
+        for name, (query, params) in queries.items():
+            plans[name] = [row[3] for row in self.db_connection.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        return plans
+
+
+class EventWriter:
+    # buffers rows per table and flushes them with executemany. ids are assigned here, so the dividend cross-references
+    # are written directly instead of being looked up. The epoch and denormalized dividend columns that
+    # SqliteDB.optimize() adds are filled in when the database has them
+    _connection: Connection
+    _next_id: int
+    _columns: dict[str, list[str]]
+    _rows: dict[str, list[tuple]]
+    _has_epoch_columns: bool
+    _trading_days: set[str] | None
+    _buffered: int
+    _flush_size: int
+
+    def __init__(self, connection: Connection, flush_size: int = 100000):
+        self._connection = connection
+        self._next_id = (connection.execute("SELECT MAX(id) FROM event").fetchone()[0] or 0) + 1
+        self._columns = {
+            "event": ["id", "type", "begin", "end", "ticker", "exchange"],
+            "ohlcv": ["event_id", "open", "high", "low", "close", "volume"],
+            "dividend_announcement": ["event_id", "ex_dividend_id", "dividend_payment_id", "amount"],
+            "ex_dividend": ["event_id", "dividend_announcement_id", "dividend_payment_id", "amount"],
+            "dividend_payment": ["event_id", "dividend_announcement_id", "ex_dividend_id", "amount"],
+            "earnings": ["event_id", "eps", "eps_estimate", "number_of_estimates", "fiscal_quarter_ending"],
+        }
+        for table, optional_columns in [("event", ["begin_epoch", "end_epoch"]),
+                                        ("dividend_announcement", ["ex_dividend_begin", "dividend_payment_begin"]),
+                                        ("ex_dividend", ["dividend_payment_begin"])]:
+            existing = set(row[1] for row in connection.execute(f"PRAGMA table_info({table})"))
+            self._columns[table] += [column for column in optional_columns if column in existing]
+        self._rows = {table: [] for table in self._columns}
+        self._has_epoch_columns = "begin_epoch" in self._columns["event"]
+        has_trading_calendar = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'trading_day'").fetchone() is not None
+        self._trading_days = set() if has_trading_calendar else None
+        self._buffered = 0
+        self._flush_size = flush_size
+
+    def add_event(self, type: str, begin: datetime | date | str, end: datetime | date | str, ticker: str, exchange: str) -> int:
+        id = self._next_id
+        self._next_id += 1
+        begin, end = to_datetime(begin), to_datetime(end)
+        row = (id, type, begin.isoformat(" "), end.isoformat(" "), ticker, exchange)
+        if self._has_epoch_columns:
+            row += ((begin - EPOCH) // MICROSECOND, (end - EPOCH) // MICROSECOND)
+        if self._trading_days is not None:
+            self._trading_days.add(row[2][:10])
+        self._add_row("event", row)
+        return id
+
+    def add_ohlcv(self, begin: datetime | date | str, end: datetime | date | str, ticker: str, exchange: str,
+                  open: int, high: int, low: int, close: int, volume: int) -> int:
+        id = self.add_event(EVENT_TYPE_OHLCV, begin, end, ticker, exchange)
+        self._add_row("ohlcv", (id, open, high, low, close, volume))
+        return id
+
+    def add_dividend(self, ticker: str, exchange: str, announced: datetime | date | str, ex_dividend: datetime | date | str,
+                     payment: datetime | date | str, amount: int) -> tuple[int, int, int]:
+        # writes the announcement, ex-dividend and payment events of one dividend and links them
+        announced, ex_dividend, payment = to_datetime(announced), to_datetime(ex_dividend), to_datetime(payment)
+        announcement_id = self.add_event(EVENT_TYPE_DIVIDEND_ANNOUNCEMENT, announced, announced, ticker, exchange)
+        ex_dividend_id = self.add_event(EVENT_TYPE_EX_DIVIDEND, ex_dividend, ex_dividend, ticker, exchange)
+        payment_id = self.add_event(EVENT_TYPE_DIVIDEND_PAYMENT, payment, payment, ticker, exchange)
+
+        self._add_row("dividend_announcement", (announcement_id, ex_dividend_id, payment_id, amount, ex_dividend.isoformat(" "), payment.isoformat(" ")))
+        self._add_row("ex_dividend", (ex_dividend_id, announcement_id, payment_id, amount, payment.isoformat(" ")))
+        self._add_row("dividend_payment", (payment_id, announcement_id, ex_dividend_id, amount))
+        return announcement_id, ex_dividend_id, payment_id
+
+    def add_earnings(self, begin: datetime | date | str, end: datetime | date | str, ticker: str, exchange: str,
+                     eps: int, eps_estimate: int | None, number_of_estimates: int, fiscal_quarter_ending: date | str) -> int:
+        id = self.add_event(EVENT_TYPE_EARNINGS, begin, end, ticker, exchange)
+        if isinstance(fiscal_quarter_ending, str):
+            fiscal_quarter_ending = date.fromisoformat(fiscal_quarter_ending)
+        self._add_row("earnings", (id, eps, eps_estimate, number_of_estimates, fiscal_quarter_ending.isoformat()))
+        return id
+
+    def flush(self):
+        for table, rows in self._rows.items():
+            if len(rows) > 0:
+                columns = self._columns[table]
+                self._connection.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+                rows.clear()
+
+        if self._trading_days:
+            self._connection.executemany("INSERT OR IGNORE INTO trading_day (date) VALUES (?)", [(day,) for day in self._trading_days])
+            self._trading_days.clear()
+        self._buffered = 0
+
+    def _add_row(self, table: str, row: tuple):
+        # rows are given with every optional column; the ones the table doesn't have are dropped
+        self._rows[table].append(row[:len(self._columns[table])])
+        self._buffered += 1
+        if self._buffered >= self._flush_size:
+            self.flush()
+
+def create_event_database(path: str):
+    # creates the schema in a new database file, leaving an existing one untouched
+    connection = sqlite3.connect(path)
+    with connection:
+        if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'event'").fetchone() is None:
+            for statement in EVENT_SCHEMA:
+                connection.execute(statement)
+    connection.close()
+
+def read_event_records(path: str, format: str | None = None) -> Iterator[dict]:
+    # records from a CSV file with a header row or a JSON-lines file, chosen by extension unless format is given
+    if format is None:
+        format = "csv" if path.lower().endswith(".csv") else "jsonl"
+
+    with open(path, newline="") as input:
+        if format == "csv":
+            yield from csv.DictReader(input)
+        else:
+            for line in input:
+                if line.strip():
+                    yield json.loads(line)
+
+def _optional_int(value) -> int | None:
+    return None if value is None or value == "" else int(value)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintenance commands for a simply_backtest event database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    optimize_parser = subparsers.add_parser("optimize", help="add indexes, epoch columns and denormalized dividend dates")
+    optimize_parser.add_argument("path")
+
+    ingest_parser = subparsers.add_parser("ingest", help="load CSV or JSON-lines event records, creating the database if needed")
+    ingest_parser.add_argument("path")
+    ingest_parser.add_argument("inputs", nargs="+")
+    ingest_parser.add_argument("--type", help="record type for inputs without a type column: OHLCV, DIVIDEND or EARNINGS")
+    ingest_parser.add_argument("--format", choices=["csv", "jsonl"], help="input format; by default .csv files are CSV and anything else JSON lines")
+    ingest_parser.add_argument("--keep-indexes", action="store_true", help="maintain indexes during the load, faster for small appends")
+    ingest_parser.add_argument("--no-skip-existing", action="store_true", help="write records even if they are not newer than the stored data")
+
+    rollup_parser = subparsers.add_parser("rollup", help="build or update OHLCV rollups")
+    rollup_parser.add_argument("path")
+    rollup_parser.add_argument("--resolution", action="append", choices=list(RESOLUTIONS),
+                               help="resolution to maintain, may be repeated; defaults to the ones already built")
+    rollup_parser.add_argument("--rebuild", action="store_true", help="recompute every bucket instead of resuming from the last one")
+
+    args = parser.parse_args()
+
+    if args.command == "rollup":
+        started = time.perf_counter()
+        counts = SqliteDB(args.path).build_rollups(args.resolution, rebuild=args.rebuild)
+        for resolution, count in counts.items():
+            print(f"{resolution}: {count} bars written")
+        print(f"Rolled up {args.path} in {time.perf_counter() - started:.1f}s")
+
+    if args.command == "ingest":
+        create_event_database(args.path)
+        db = SqliteDB(args.path)
+        records = itertools.chain.from_iterable(read_event_records(input, args.format) for input in args.inputs)
+        started = time.perf_counter()
+        counts = db.ingest(records, args.type, defer_indexes=not args.keep_indexes, skip_existing=not args.no_skip_existing)
+        print(f"Loaded {counts} into {args.path} in {time.perf_counter() - started:.1f}s")
+
+    if args.command == "optimize":
+        for name, (before, after) in SqliteDB(args.path).optimize().items():
+            print(name)
+            print("  before:")
+            for line in before:
+                print(f"    {line}")
+            print("  after:")
+            for line in after:
+                print(f"    {line}")
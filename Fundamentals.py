@@ -0,0 +1,115 @@
+import datetime
+from typing import Iterable
+import numpy as np
+from DB import DividendAnnouncement, Earnings, Event, ExDividend, to_datetime, to_epoch
+
+# the number of quarterly reports summed into trailing twelve month EPS
+TTM_REPORTS = 4
+YEAR = datetime.timedelta(days=365)
+
+# begin is the epoch microseconds the report became known and fiscal_quarter_ending a proleptic Gregorian ordinal.
+# eps_estimate and the surprises are NaN without an estimate, ttm_eps is NaN until there are TTM_REPORTS reports
+EARNINGS_DTYPE = np.dtype([("begin", np.int64), ("eps", np.float64), ("eps_estimate", np.float64), ("number_of_estimates", np.int64),
+                           ("fiscal_quarter_ending", np.int64), ("ttm_eps", np.float64), ("surprise", np.float64), ("surprise_percent", np.float64)])
+# begin is the ex-dividend date in epoch microseconds, amount is per share in the same units as prices
+DIVIDEND_DTYPE = np.dtype([("begin", np.int64), ("amount", np.float64)])
+
+class Fundamentals:
+    # Point-in-time earnings and dividend history. Each ticker's reports and ex-dividends are kept as structured arrays
+    # sorted by begin, with TTM EPS and surprises precomputed per report and running dividend sums, so every as-of
+    # lookup is a searchsorted over the ticker's begins. A record counts as known from its begin, as events do
+    _earnings: dict[str, np.ndarray]
+    _earnings_begins: dict[str, np.ndarray]
+    _dividends: dict[str, np.ndarray]
+    _dividend_begins: dict[str, np.ndarray]
+    _dividend_sums: dict[str, np.ndarray]
+    _announcements: dict[str, list[DividendAnnouncement]]
+    _announcement_begins: dict[str, np.ndarray]
+
+    def __init__(self, events: Iterable[Event]):
+        # events of any type; only Earnings, ExDividend and DividendAnnouncement are kept
+        earnings: dict[str, list[Earnings]] = {}
+        dividends: dict[str, list[ExDividend]] = {}
+        announcements: dict[str, list[DividendAnnouncement]] = {}
+        for event in events:
+            if isinstance(event, Earnings):
+                earnings.setdefault(event.ticker, []).append(event)
+            elif isinstance(event, ExDividend):
+                dividends.setdefault(event.ticker, []).append(event)
+            elif isinstance(event, DividendAnnouncement):
+                announcements.setdefault(event.ticker, []).append(event)
+
+        self._earnings = {ticker: _earnings_rows(reports) for ticker, reports in earnings.items()}
+        self._earnings_begins = {ticker: np.ascontiguousarray(rows["begin"]) for ticker, rows in self._earnings.items()}
+
+        self._dividends = {}
+        self._dividend_begins = {}
+        self._dividend_sums = {}
+        for ticker, ticker_dividends in dividends.items():
+            rows = np.array(sorted((to_epoch(dividend.begin), dividend.amount) for dividend in ticker_dividends), dtype=DIVIDEND_DTYPE)
+            self._dividends[ticker] = rows
+            self._dividend_begins[ticker] = np.ascontiguousarray(rows["begin"])
+            self._dividend_sums[ticker] = np.concatenate([[0], np.cumsum(rows["amount"])])
+
+        self._announcements = {}
+        self._announcement_begins = {}
+        for ticker, ticker_announcements in announcements.items():
+            begins = [to_epoch(announcement.begin) for announcement in ticker_announcements]
+            order = np.argsort(begins, kind="stable")
+            self._announcements[ticker] = [ticker_announcements[index] for index in order.tolist()]
+            self._announcement_begins[ticker] = np.array(begins, dtype=np.int64)[order]
+
+    def get_earnings(self, ticker: str, as_of: datetime.datetime, count: int = TTM_REPORTS) -> np.ndarray:
+        # the last count reports known at as_of, oldest first, as EARNINGS_DTYPE rows
+        last = _count_known(self._earnings_begins.get(ticker), as_of)
+        if last == 0:
+            return np.empty(0, dtype=EARNINGS_DTYPE)
+        return self._earnings[ticker][max(last - count, 0):last]
+
+    def get_latest_earnings(self, ticker: str, as_of: datetime.datetime) -> np.void | None:
+        last = _count_known(self._earnings_begins.get(ticker), as_of)
+        return None if last == 0 else self._earnings[ticker][last - 1]
+
+    def get_dividends(self, ticker: str, as_of: datetime.datetime, count: int = TTM_REPORTS) -> np.ndarray:
+        # the last count ex-dividends on or before as_of, oldest first, as DIVIDEND_DTYPE rows
+        last = _count_known(self._dividend_begins.get(ticker), as_of)
+        if last == 0:
+            return np.empty(0, dtype=DIVIDEND_DTYPE)
+        return self._dividends[ticker][max(last - count, 0):last]
+
+    def get_trailing_dividends(self, ticker: str, as_of: datetime.datetime, window: datetime.timedelta = YEAR) -> float:
+        # per share amount of the ex-dividends in (as_of - window, as_of]
+        sums = self._dividend_sums.get(ticker)
+        if sums is None:
+            return 0.0
+        begins = self._dividend_begins[ticker]
+        return float(sums[_count_known(begins, as_of)] - sums[_count_known(begins, to_datetime(as_of) - window)])
+
+    def get_latest_dividend_announcement(self, ticker: str, as_of: datetime.datetime) -> DividendAnnouncement | None:
+        last = _count_known(self._announcement_begins.get(ticker), as_of)
+        return None if last == 0 else self._announcements[ticker][last - 1]
+
+def _earnings_rows(reports: list[Earnings]) -> np.ndarray:
+    reports = sorted(reports, key=lambda report: to_epoch(report.begin))
+    rows = np.zeros(len(reports), dtype=EARNINGS_DTYPE)
+    rows["begin"] = [to_epoch(report.begin) for report in reports]
+    rows["eps"] = [report.eps for report in reports]
+    rows["eps_estimate"] = [np.nan if report.eps_estimate is None else report.eps_estimate for report in reports]
+    rows["number_of_estimates"] = [report.number_of_estimates for report in reports]
+    rows["fiscal_quarter_ending"] = [report.fiscal_quarter_ending_date.toordinal() for report in reports]
+
+    sums = np.concatenate([[0], np.cumsum(rows["eps"])])
+    rows["ttm_eps"] = np.nan
+    rows["ttm_eps"][TTM_REPORTS - 1:] = sums[TTM_REPORTS:] - sums[:-TTM_REPORTS]
+
+    rows["surprise"] = rows["eps"] - rows["eps_estimate"]
+    estimates = np.abs(rows["eps_estimate"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rows["surprise_percent"] = np.where(estimates > 0, rows["surprise"] / estimates, np.nan)
+    return rows
+
+def _count_known(begins: np.ndarray | None, as_of: datetime.datetime) -> int:
+    # how many of the sorted begins are at or before as_of
+    if begins is None:
+        return 0
+    return int(np.searchsorted(begins, to_epoch(as_of), side="right"))
@@ -1,6 +1,18 @@
 from abc import ABC, abstractmethod
 import datetime
-from DB import SqliteDB, Event
+import bisect
+from collections import OrderedDict
+import heapq
+import itertools
+import queue
+import threading
+from typing import Callable, Container, Iterator, Sequence
+import numpy as np
+from Fundamentals import YEAR, Fundamentals
+from Resample import aggregate_bars, iterate_rollup_rows
+from Snapshot import Snapshot
+from DB import (EVENT_CLASSES, EVENT_TYPE_DIVIDEND_ANNOUNCEMENT, EVENT_TYPE_DIVIDEND_PAYMENT, EVENT_TYPE_EARNINGS, EVENT_TYPE_EX_DIVIDEND, EVENT_TYPE_OHLCV,
+                OHLCV, DividendAnnouncement, SqliteDB, Event, EPOCH, EventBatch, filter_events, from_epoch, to_datetime, to_epoch)
 
 class HistoricalData(ABC):
     @abstractmethod
@@ -12,44 +24,859 @@ class HistoricalData(ABC):
         pass
 
     @abstractmethod
-    def get_events(self, ticker: str, begin: datetime.datetime, end: datetime.datetime) -> list[Event]:
+    def get_events(self, ticker: str, begin: datetime.datetime, end: datetime.datetime, resolution: str | None = None) -> list[Event]:
+        # with a resolution (one of Resample.RESOLUTIONS) only OHLCV bars rolled up to it are returned, and only once they have ended
         pass
 
     @abstractmethod
     def get_current_price(self, ticker: str) -> int:
         pass
-    
+
+    def get_current_prices(self, tickers: Sequence[str]) -> np.ndarray:
+        # get_current_price for each ticker as a float array aligned with tickers, NaN where there is no price
+        prices = [self.get_current_price(ticker) for ticker in tickers]
+        return np.array([np.nan if price is None else price for price in prices], dtype=np.float64)
+
+    def get_events_many(self, tickers: Sequence[str], begin: datetime.datetime, end: datetime.datetime) -> dict[str, list[Event]]:
+        # get_events for each ticker
+        return {ticker: self.get_events(begin=begin, end=end, ticker=ticker) for ticker in tickers}
+
+    def get_fundamentals(self) -> Fundamentals:
+        # the earnings and dividend history the lookups below read, built on first use
+        raise NotImplementedError(f"{type(self).__name__} has no fundamentals store")
+
+    def get_earnings_history(self, ticker: str, count: int = 4) -> np.ndarray:
+        # the last count earnings reports as of the current timestamp, oldest first, as Fundamentals.EARNINGS_DTYPE rows
+        return self.get_fundamentals().get_earnings(ticker, self.get_timestamp(), count)
+
+    def get_latest_earnings(self, ticker: str) -> np.void | None:
+        # the latest report as of the current timestamp, with its ttm_eps, surprise and surprise_percent
+        return self.get_fundamentals().get_latest_earnings(ticker, self.get_timestamp())
+
+    def get_dividend_history(self, ticker: str, count: int = 4) -> np.ndarray:
+        return self.get_fundamentals().get_dividends(ticker, self.get_timestamp(), count)
+
+    def get_trailing_dividends(self, ticker: str, window: datetime.timedelta = YEAR) -> float:
+        return self.get_fundamentals().get_trailing_dividends(ticker, self.get_timestamp(), window)
+
+    def get_trailing_dividend_yield(self, ticker: str, window: datetime.timedelta = YEAR) -> float | None:
+        # trailing dividends over the current price, None without a price
+        price = self.get_current_price(ticker)
+        if not price:
+            return None
+        return self.get_trailing_dividends(ticker, window) / price
+
+    def get_latest_dividend_announcement(self, ticker: str) -> DividendAnnouncement | None:
+        return self.get_fundamentals().get_latest_dividend_announcement(ticker, self.get_timestamp())
+
+    def handle_events(self, events: Sequence[Event]):
+        # called by the backtester with each group of events as the clock advances
+        pass
+
+    def register_lookback(self, lookback: datetime.timedelta):
+        # lets callers announce how far back their repeated get_events windows reach
+        pass
+
+    def stream_event_batches(self, begin: datetime.datetime, end: datetime.datetime, chunk_size: int = 10000) -> Iterator[Sequence[Event]]:
+        # groups of events sharing a begin, in order
+        return group_events_by_begin(self.stream_events_unrestricted(begin, end, chunk_size))
+
+    def get_trading_days(self, begin: datetime.date, end: datetime.date) -> list[datetime.date] | None:
+        # the dates in [begin, end] that have events, or None when the backend can't tell
+        return None
+
+    def prefetch_event_batches(self, begin: datetime.datetime, end: datetime.datetime, chunk_size: int = 10000, depth: int = 4) -> Iterator[Sequence[Event]]:
+        # stream_event_batches read and decoded on a worker thread, up to depth batches ahead of the consumer
+        return prefetch(lambda: (list(batch) for batch in self.stream_event_batches(begin, end, chunk_size)), depth)
+
+    def get_ohlcv_panel(self, begin: datetime.datetime, end: datetime.datetime, tickers: list[str] | None = None) -> "OHLCVPanel":
+        # every event in [begin, end] laid out as an OHLCVPanel, by default by decoding the whole stream
+        ticker_filter = None if tickers is None else set(tickers)
+        bars: dict[str, list[OHLCV]] = {}
+        others = []
+        for events in self.stream_event_batches(begin, end):
+            for event in filter_events(events, None, ticker_filter):
+                if isinstance(event, OHLCV):
+                    bars.setdefault(event.ticker, []).append(event)
+                else:
+                    others.append(event)
+
+        columns = {ticker: [np.array([to_epoch(bar.begin) for bar in ticker_bars], dtype=np.int64), np.array([to_epoch(bar.end) for bar in ticker_bars], dtype=np.int64)]
+                   + [np.array([getattr(bar, field) for bar in ticker_bars], dtype=np.float64) for field in ["open", "high", "low", "close", "volume"]]
+                   for ticker, ticker_bars in bars.items()}
+        return OHLCVPanel(columns, {ticker: ticker_bars[0].exchange for ticker, ticker_bars in bars.items()}, others)
+
+
+def group_events_by_begin(events: Iterator[Event]) -> Iterator[list[Event]]:
+    # events arrive ordered by begin so consecutive runs with the same begin form a group
+    group: list[Event] = []
+    for event in events:
+        if len(group) > 0 and event.begin != group[0].begin:
+            yield group
+            group = []
+        group.append(event)
+
+    if len(group) > 0:
+        yield group
+
+
+_PREFETCH_DONE = object()
+
+def prefetch(factory: Callable[[], Iterator], depth: int) -> Iterator:
+    # iterates factory() on a worker thread into a queue of at most depth items. The iterator is created on the worker
+    # so any sqlite connection it opens belongs to that thread; closing this generator early stops the worker
+    items = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work():
+        try:
+            for item in factory():
+                if not put((item, None)):
+                    return
+            put((_PREFETCH_DONE, None))
+        except BaseException as e:
+            put((None, e))
+
+    worker = threading.Thread(target=work, name="event-prefetch", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _PREFETCH_DONE:
+                return
+            yield item
+    finally:
+        stopped.set()
+        worker.join()
+
+
+class LookbackWindow:
+    # one ticker's events in begin order; the live part starts at _head so evicting from the front
+    # is a pointer move, with the dead prefix compacted away once it is half the buffer
+    _begins: list[datetime.datetime]
+    _events: list[Event]
+    _head: int
+    covered_from: datetime.datetime
+
+    def __init__(self, covered_from: datetime.datetime, events: list[Event]):
+        self._begins = [to_datetime(event.begin) for event in events]
+        self._events = list(events)
+        self._head = 0
+        self.covered_from = covered_from
+
+    def __len__(self) -> int:
+        return len(self._events) - self._head
+
+    def append(self, begin: datetime.datetime, event: Event):
+        self._begins.append(begin)
+        self._events.append(event)
+
+    def evict_before(self, cutoff: datetime.datetime) -> int:
+        if cutoff <= self.covered_from:
+            return 0
+        self.covered_from = cutoff
+
+        head = bisect.bisect_left(self._begins, cutoff, lo=self._head)
+        evicted = head - self._head
+        self._head = head
+
+        if self._head > len(self._events) // 2:
+            del self._begins[:self._head]
+            del self._events[:self._head]
+            self._head = 0
+        return evicted
+
+    def get_events(self, begin: datetime.datetime, end: datetime.datetime) -> list[Event]:
+        first = bisect.bisect_left(self._begins, begin, lo=self._head)
+        last = bisect.bisect_right(self._begins, end, lo=first)
+        return self._events[first:last]
+
+
+class LookbackCache:
+    # per-ticker windows of recent events, extended as the event feed is pushed through and trimmed to the
+    # longest registered lookback, with whole tickers dropped least recently used first past max_events.
+    # A window is only trimmed when the feed adds to it or it is read, so a push costs what the group touches
+    _windows: OrderedDict[str, LookbackWindow]
+    _lookback: datetime.timedelta
+    _max_events: int
+    _size: int
+    _cutoff: datetime.datetime | None
+
+    def __init__(self, max_events: int):
+        self._windows = OrderedDict()
+        self._lookback = datetime.timedelta(0)
+        self._max_events = max_events
+        self._size = 0
+        self._cutoff = None
+
+    def register_lookback(self, lookback: datetime.timedelta):
+        self._lookback = max(self._lookback, lookback)
+
+    def get_lookback(self) -> datetime.timedelta:
+        return self._lookback
+
+    def get(self, ticker: str, begin: datetime.datetime, end: datetime.datetime) -> list[Event] | None:
+        window = self._windows.get(ticker)
+        if window is None:
+            return None
+
+        if self._cutoff is not None:
+            self._size -= window.evict_before(self._cutoff)
+        if begin < window.covered_from:
+            return None
+
+        self._windows.move_to_end(ticker)
+        return window.get_events(begin, end)
+
+    def put(self, ticker: str, covered_from: datetime.datetime, events: list[Event]):
+        self.drop(ticker)
+        self._windows[ticker] = LookbackWindow(covered_from, events)
+        self._size += len(events)
+        self._enforce_limit()
+
+    def drop(self, ticker: str):
+        window = self._windows.pop(ticker, None)
+        if window is not None:
+            self._size -= len(window)
+
+    def clear(self):
+        self._windows = OrderedDict()
+        self._size = 0
+        self._cutoff = None
+
+    def push(self, events: Sequence[Event], now: datetime.datetime):
+        self._cutoff = now - self._lookback
+        touched = {}
+        for event in filter_events(events, None, self._windows):
+            window = self._windows[event.ticker]
+            window.append(to_datetime(event.begin), event)
+            touched[event.ticker] = window
+            self._size += 1
+
+        for window in touched.values():
+            self._size -= window.evict_before(self._cutoff)
+
+        self._enforce_limit()
+
+    def _enforce_limit(self):
+        while self._size > self._max_events and len(self._windows) > 1:
+            _, window = self._windows.popitem(last=False)
+            self._size -= len(window)
+
 
 class SQLHistoricalData(HistoricalData):
     _current_timestamp: datetime.datetime
     _db: SqliteDB
+    _latest_bars: dict[str, OHLCV | None]
+    _tracking_events: bool
+    _fed_through: datetime.datetime | None
+    _lookback_cache: LookbackCache
+    _fundamentals: Fundamentals | None
 
-    def __init__(self, db: SqliteDB):
+    def __init__(self, db: SqliteDB, max_cached_events: int = 1000000):
         self._current_timestamp = datetime.datetime.now()
         self._db = db
+        self._latest_bars = {}
+        self._tracking_events = False
+        self._fed_through = None
+        self._lookback_cache = LookbackCache(max_cached_events)
+        self._fundamentals = None
+
+    def get_fundamentals(self) -> Fundamentals:
+        # the whole history of every ticker in three queries, so trailing figures are complete from the first day
+        if self._fundamentals is None:
+            self._fundamentals = Fundamentals(itertools.chain.from_iterable(self._db.get_events(event_type=event_type)
+                                                                            for event_type in [EVENT_TYPE_EARNINGS, EVENT_TYPE_EX_DIVIDEND, EVENT_TYPE_DIVIDEND_ANNOUNCEMENT]))
+        return self._fundamentals
+
+    def get_events(self, begin: datetime.datetime, end: datetime.datetime, ticker: str | None = None, resolution: str | None = None):
+        current_timestamp = to_datetime(self._current_timestamp)
+        if resolution is not None:
+            # rolled-up bars become visible once they have ended, by the clock
+            return self._get_rollup_bars(min(begin, current_timestamp), min(end, current_timestamp), ticker, resolution)
+
+        end = self._clamp_to_visible(end)
+        if begin > end:
+            return []
+
+        if ticker is None or not self._tracking_events or self._lookback_cache.get_lookback() == datetime.timedelta(0):
+            return self._db.get_events(begin=[begin, end], ticker=ticker)
+
+        # once the feed is flowing, the cache holds every event for the ticker from its covered_from up to the
+        # last pushed begin, and nothing later can have been delivered yet
+        window_start = current_timestamp - self._lookback_cache.get_lookback()
+        if begin < window_start:
+            return self._db.get_events(begin=[begin, end], ticker=ticker)
+
+        events = self._lookback_cache.get(ticker, begin, end)
+        if events is None:
+            self._lookback_cache.put(ticker, window_start, self._db.get_events(begin=[window_start, self._fed_through], ticker=ticker))
+            events = self._lookback_cache.get(ticker, begin, end)
+
+        return events
+
+    def get_events_many(self, tickers: Sequence[str], begin: datetime.datetime, end: datetime.datetime) -> dict[str, list[Event]]:
+        # the same windows get_events would return, with every ticker the lookback cache can't answer read in one query
+        current_timestamp = to_datetime(self._current_timestamp)
+        end = self._clamp_to_visible(end)
+        if begin > end:
+            return {ticker: [] for ticker in tickers}
+
+        window_start = current_timestamp - self._lookback_cache.get_lookback()
+        if not self._tracking_events or self._lookback_cache.get_lookback() == datetime.timedelta(0) or begin < window_start:
+            return self._db.get_events_many(tickers, begin=[begin, end])
+
+        events_by_ticker = {ticker: self._lookback_cache.get(ticker, begin, end) for ticker in tickers}
+        missing = [ticker for ticker, events in events_by_ticker.items() if events is None]
+        if len(missing) > 0:
+            for ticker, events in self._db.get_events_many(missing, begin=[window_start, self._fed_through]).items():
+                self._lookback_cache.put(ticker, window_start, events)
+                # the cache may evict other tickers while filling, so the windows are cut from the fetched events
+                events_by_ticker[ticker] = LookbackWindow(window_start, events).get_events(begin, end)
+
+        return events_by_ticker
 
-    def get_events(self, begin: datetime.datetime, end: datetime.datetime, ticker: str | None = None):
-        if begin > self._current_timestamp:
-            begin = self._current_timestamp
-        if end > self._current_timestamp:
-            end = self._current_timestamp
+    def register_lookback(self, lookback: datetime.timedelta):
+        self._lookback_cache.register_lookback(lookback)
 
-        return self._db.get_events(begin=[begin, end], ticker=ticker)
+    def _clamp_to_visible(self, end: datetime.datetime) -> datetime.datetime:
+        # while the backtester is feeding events, what is visible is what has been delivered: everything beginning up to
+        # the last group fed. That excludes a bar beginning exactly at the clock, which the feed hasn't reached yet.
+        # Without a feed, everything beginning up to the clock is visible. A window starting later is empty
+        visible_through = self._fed_through if self._tracking_events else to_datetime(self._current_timestamp)
+        return min(end, visible_through)
 
     def get_events_unrestricted(self, begin: datetime.datetime, end: datetime.datetime):
         return self._db.get_events(begin=[begin, end])
 
+    def stream_events_unrestricted(self, begin: datetime.datetime, end: datetime.datetime, chunk_size: int = 10000) -> Iterator[Event]:
+        return self._db.iterate_events(begin=[begin, end], chunk_size=chunk_size)
+
+    def stream_event_batches(self, begin: datetime.datetime, end: datetime.datetime, chunk_size: int = 10000) -> Iterator[Sequence[Event]]:
+        return self._db.iterate_event_batches(begin=[begin, end], chunk_size=chunk_size)
+
+    def get_trading_days(self, begin: datetime.date, end: datetime.date) -> list[datetime.date]:
+        return self._db.get_trading_days(begin, end)
+
+    def get_ohlcv_panel(self, begin: datetime.datetime, end: datetime.datetime, tickers: list[str] | None = None) -> "OHLCVPanel":
+        # the bars come straight from the raw rows; only the sparse event types are decoded
+        columns = {}
+        exchanges = {}
+        rows = (row for chunk in self._db.iterate_ohlcv_row_chunks(tickers, [begin, end]) for row in chunk)
+        for ticker, ticker_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            ticker_rows = list(ticker_rows)
+            exchanges[ticker] = ticker_rows[0][1]
+            values = list(zip(*ticker_rows))
+            columns[ticker] = [np.array(values[2], dtype=np.int64), np.array(values[3], dtype=np.int64)] + [np.array(column, dtype=np.float64) for column in values[4:]]
+
+        ticker_filter = None if tickers is None else set(tickers)
+        others = [event for event_type in [EVENT_TYPE_DIVIDEND_ANNOUNCEMENT, EVENT_TYPE_EX_DIVIDEND, EVENT_TYPE_DIVIDEND_PAYMENT, EVENT_TYPE_EARNINGS]
+                  for event in self._db.get_events(event_type=event_type, begin=[begin, end])
+                  if ticker_filter is None or event.ticker in ticker_filter]
+        return OHLCVPanel(columns, exchanges, others)
+
+    def prefetch_event_batches(self, begin: datetime.datetime, end: datetime.datetime, chunk_size: int = 10000, depth: int = 4) -> Iterator[Sequence[Event]]:
+        # the worker reads through its own pooled connection; lazily loaded dividend dates are looked up on first
+        # read through the connection of whichever thread reads them
+        def read_batches() -> Iterator[EventBatch]:
+            for batch in self._db.iterate_event_batches(begin=[begin, end], chunk_size=chunk_size):
+                yield batch.decode()
+
+        return prefetch(read_batches, depth)
+
     def update_timestamp(self, timestamp: datetime.datetime):
+        # the last-bar table is only valid while time moves forward
+        if to_datetime(timestamp) < to_datetime(self._current_timestamp):
+            self._latest_bars = {}
+            self._tracking_events = False
+            self._fed_through = None
+            self._lookback_cache.clear()
+
         self._current_timestamp = timestamp
 
     def get_timestamp(self) -> datetime.datetime:
         return self._current_timestamp
 
+    def get_db(self) -> SqliteDB:
+        return self._db
+
+    def handle_events(self, events: Sequence[Event]):
+        self._tracking_events = True
+        self._fed_through = to_datetime(events[0].begin)
+        for event in filter_events(events, EVENT_TYPE_OHLCV):
+            self._latest_bars[event.ticker] = event
+
+        self._lookback_cache.push(events, to_datetime(self._current_timestamp))
+
     def get_current_price(self, ticker: str) -> int | None:
-        latest_ohlcv = self._db.get_latest_event(ticker, 'OHLCV', self._current_timestamp)
+        if ticker in self._latest_bars:
+            latest_ohlcv = self._latest_bars[ticker]
+        else:
+            latest_ohlcv = self._db.get_latest_event(ticker, 'OHLCV', self._current_timestamp)
+
+            # once events are being pushed through handle_events, any later bar for this ticker will replace this one
+            if self._tracking_events:
+                self._latest_bars[ticker] = latest_ohlcv
 
         if latest_ohlcv is None:
             return None
 
         return latest_ohlcv.open
-    
+
+    def _get_rollup_bars(self, begin: datetime.datetime, end: datetime.datetime, ticker: str | None, resolution: str) -> list[Event]:
+        current_timestamp = to_datetime(self._current_timestamp)
+        if self._db.has_rollup(resolution):
+            return self._db.get_rollup_bars(resolution, ticker, [begin, end], current_timestamp)
+
+        # without stored rollups the raw bars are read and rolled up here; buckets starting before begin aren't returned, so
+        # reading from begin sees all of their bars
+        rows = (row for chunk in self._db.iterate_ohlcv_row_chunks(None if ticker is None else [ticker], [begin, current_timestamp]) for row in chunk)
+        begin_epoch, end_epoch, visible_epoch = to_epoch(begin), to_epoch(end), to_epoch(current_timestamp)
+        bars = [OHLCV(from_epoch(bar_begin), from_epoch(bar_end), bar_ticker, exchange, open, high, low, close, volume)
+                for _, rollup_rows in iterate_rollup_rows(rows, [resolution])
+                for bar_ticker, exchange, bar_begin, bar_end, open, high, low, close, volume in rollup_rows
+                if begin_epoch <= bar_begin <= end_epoch and bar_end <= visible_epoch]
+        return sorted(bars, key=lambda bar: (bar.begin, bar.ticker))
+
+    def get_current_prices(self, tickers: Sequence[str]) -> np.ndarray:
+        # tickers without a tracked bar are looked up together in one query
+        missing = [ticker for ticker in tickers if ticker not in self._latest_bars]
+        if len(missing) > 0:
+            latest = self._db.get_latest_events(missing, 'OHLCV', self._current_timestamp)
+            if self._tracking_events:
+                for ticker in missing:
+                    self._latest_bars[ticker] = latest.get(ticker)
+        else:
+            latest = {}
+
+        prices = np.full(len(tickers), np.nan)
+        for index, ticker in enumerate(tickers):
+            latest_ohlcv = self._latest_bars[ticker] if ticker in self._latest_bars else latest.get(ticker)
+            if latest_ohlcv is not None:
+                prices[index] = latest_ohlcv.open
+
+        return prices
+
+
+DAY_MICROSECONDS = 86400 * 1000000
+
+class OHLCVColumns:
+    begin: np.ndarray
+    end: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+    def __init__(self, begin: np.ndarray, end: np.ndarray, open: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray, volume: np.ndarray):
+        self.begin = begin
+        self.end = end
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    @classmethod
+    def from_rows(cls, rows: list[tuple]) -> "OHLCVColumns":
+        # rows are (begin, end, open, high, low, close, volume) sorted by begin, with begin and end as epoch microseconds
+        return cls(*(np.fromiter((row[index] for row in rows), dtype=np.int64, count=len(rows)) for index in range(7)))
+
+    def __len__(self) -> int:
+        return len(self.begin)
+
+    def slice(self, begin: int, end: int) -> tuple[int, int]:
+        # index range of bars whose begin falls within [begin, end]
+        return int(np.searchsorted(self.begin, begin, side="left")), int(np.searchsorted(self.begin, end, side="right"))
+
+
+class OHLCVPanel:
+    # the bars of a ticker universe on one timeline, for vectorized strategies. There is a row for every distinct begin
+    # of a bar or other event, and a column per ticker. begin is the rows' epoch microseconds. end is an int64
+    # (rows, tickers) array, and open to volume are float64 (rows, tickers) arrays that are NaN where a ticker has no bar.
+    # Dividends and earnings are kept as events, listed under the row of their begin
+    begin: np.ndarray
+    end: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+    tickers: list[str]
+    exchanges: list[str]
+    ticker_indexes: dict[str, int]
+    _other_events: dict[int, list[Event]]
+
+    def __init__(self, columns: dict[str, list[np.ndarray]], exchanges: dict[str, str], other_events: list[Event]):
+        # columns maps each ticker to its (begin, end, open, high, low, close, volume) arrays, sorted by begin
+        self.tickers = sorted(columns)
+        self.exchanges = [exchanges[ticker] for ticker in self.tickers]
+        self.ticker_indexes = {ticker: index for index, ticker in enumerate(self.tickers)}
+
+        other_begins = np.array([to_epoch(event.begin) for event in other_events], dtype=np.int64)
+        self.begin = np.unique(np.concatenate([columns[ticker][0] for ticker in self.tickers] + [other_begins]))
+
+        shape = (len(self.begin), len(self.tickers))
+        self.end = np.zeros(shape, dtype=np.int64)
+        self.open, self.high, self.low, self.close, self.volume = (np.full(shape, np.nan) for _ in range(5))
+        for column, ticker in enumerate(self.tickers):
+            begin, end, *values = columns[ticker]
+            rows = np.searchsorted(self.begin, begin)
+            self.end[rows, column] = end
+            for field, field_values in zip([self.open, self.high, self.low, self.close, self.volume], values):
+                field[rows, column] = field_values
+
+        self._other_events = {}
+        for row, event in zip(np.searchsorted(self.begin, other_begins).tolist(), other_events):
+            self._other_events.setdefault(row, []).append(event)
+
+    def __len__(self) -> int:
+        return len(self.begin)
+
+    def get_other_events(self, row: int) -> list[Event]:
+        return self._other_events.get(row, [])
+
+    def iterate_batches(self, first_row: int = 0) -> Iterator["PanelBatch"]:
+        for row in range(first_row, len(self.begin)):
+            yield PanelBatch(self, row)
+
+
+class PanelBatch(EventBatch):
+    # one panel row as an event group: the row's bars followed by its other events, each decoded the first time it is
+    # read. filter() looks tickers up by column when given a dict or set, so feeding a brokerage that tracks a handful
+    # of tickers costs a handful of lookups however wide the panel is
+    __slots__ = ("row", "_panel", "_columns", "_others", "_bars", "_values", "_timestamps")
+    row: int
+    _panel: OHLCVPanel
+    _columns: np.ndarray
+    _others: list[Event]
+    _bars: dict[int, OHLCV]
+    _values: list[list] | None
+    _timestamps: dict[int, datetime.datetime]
+
+    def __init__(self, panel: OHLCVPanel, row: int):
+        self.row = row
+        self._panel = panel
+        self._columns = np.flatnonzero(~np.isnan(panel.close[row]))
+        self._others = panel.get_other_events(row)
+        self._bars = {}
+        self._values = None
+        self._timestamps = {}
+
+    def __len__(self) -> int:
+        return len(self._columns) + len(self._others)
+
+    def __getitem__(self, index: int) -> Event:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if index >= len(self._columns):
+            return self._others[index - len(self._columns)]
+        return self._get_bar(int(self._columns[index]))
+
+    def decode(self) -> "PanelBatch":
+        for index in range(len(self._columns)):
+            self[index]
+        return self
+
+    def get_type(self, index: int) -> str:
+        if index < len(self._columns):
+            return EVENT_TYPE_OHLCV
+        event = self._others[index - len(self._columns)]
+        return next(event_type for event_type, event_class in EVENT_CLASSES.items() if type(event) is event_class)
+
+    def get_ticker(self, index: int) -> str:
+        return self._panel.tickers[self._columns[index]] if index < len(self._columns) else self._others[index - len(self._columns)].ticker
+
+    def filter(self, event_type: str | None, tickers: Container[str] | None = None) -> Iterator[Event]:
+        if event_type is None or event_type == EVENT_TYPE_OHLCV:
+            if isinstance(tickers, (dict, set, frozenset)) and len(tickers) < len(self._columns):
+                present = self._panel.close[self.row]
+                for ticker in tickers:
+                    column = self._panel.ticker_indexes.get(ticker)
+                    if column is not None and not np.isnan(present[column]):
+                        yield self._get_bar(column)
+            else:
+                for column in self._columns.tolist():
+                    if tickers is None or self._panel.tickers[column] in tickers:
+                        yield self._get_bar(column)
+
+        event_class = Event if event_type is None else EVENT_CLASSES[event_type]
+        for event in self._others:
+            if isinstance(event, event_class) and (tickers is None or event.ticker in tickers):
+                yield event
+
+    def _get_bar(self, column: int) -> OHLCV:
+        bar = self._bars.get(column)
+        if bar is not None:
+            return bar
+
+        # the first bar read converts the whole row to Python values, which is cheaper than converting bar by bar
+        if self._values is None:
+            panel = self._panel
+            self._values = [field[self.row].tolist() for field in [panel.end, panel.open, panel.high, panel.low, panel.close, panel.volume]]
+        end, open, high, low, close, volume = (values[column] for values in self._values)
+
+        bar = OHLCV(self._get_timestamp(int(self._panel.begin[self.row])), self._get_timestamp(end), self._panel.tickers[column], self._panel.exchanges[column],
+                    open, high, low, close, int(volume))
+        self._bars[column] = bar
+        return bar
+
+    def _get_timestamp(self, epoch: int) -> datetime.datetime:
+        timestamp = self._timestamps.get(epoch)
+        if timestamp is None:
+            timestamp = from_epoch(epoch)
+            self._timestamps[epoch] = timestamp
+        return timestamp
+
+
+class ColumnarHistoricalData(HistoricalData):
+    _current_timestamp: datetime.datetime
+    _current_epoch: int
+    _db: SqliteDB
+    _ohlcv: dict[str, OHLCVColumns]
+    _exchanges: dict[str, str]
+    _other_events: dict[str, list[Event]]
+    _other_event_begins: dict[str, np.ndarray]
+    _trading_days: list[datetime.date] | None
+    _rollups: dict[tuple[str, str], OHLCVColumns]
+    _fundamentals: Fundamentals | None
+    _load_arguments: tuple
+
+    def __init__(self, db: SqliteDB, begin: datetime.datetime, end: datetime.datetime, tickers: list[str] | None = None):
+        # bulk-load the whole range once; every lookup afterwards is a searchsorted over per-ticker arrays
+        self._db = db
+        self._load_arguments = (begin, end, tickers)
+        self._reset_store()
+        self._load(begin, end, tickers)
+
+    def __getstate__(self):
+        # the loaded arrays are left out of a pickle and loaded again from the source, keeping checkpoints small
+        state = self.__dict__.copy()
+        for name in ["_ohlcv", "_exchanges", "_other_events", "_other_event_begins", "_trading_days", "_rollups", "_fundamentals"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        timestamp = self._current_timestamp
+        self._reset_store()
+        self._reload()
+        self.update_timestamp(timestamp)
+
+    def get_events(self, begin: datetime.datetime, end: datetime.datetime, ticker: str | None = None, resolution: str | None = None) -> list[Event]:
+        end_epoch = min(to_epoch(end), self._current_epoch)
+        begin_epoch = min(to_epoch(begin), self._current_epoch)
+
+        if resolution is not None:
+            tickers = sorted(self._ohlcv) if ticker is None else [ticker]
+            merged = heapq.merge(*(self._iterate_rollup_bars(ticker, resolution, begin_epoch, end_epoch) for ticker in tickers), key=lambda pair: pair[0])
+            return [event for _, event in merged]
+
+        return list(self._iterate_events(begin_epoch, end_epoch, None if ticker is None else [ticker]))
+
+    def get_events_unrestricted(self, begin: datetime.datetime, end: datetime.datetime) -> list[Event]:
+        return list(self._iterate_events(to_epoch(begin), to_epoch(end)))
+
+    def stream_events_unrestricted(self, begin: datetime.datetime, end: datetime.datetime, chunk_size: int = 10000) -> Iterator[Event]:
+        return self._iterate_events(to_epoch(begin), to_epoch(end))
+
+    def update_timestamp(self, timestamp: datetime.datetime):
+        self._current_timestamp = timestamp
+        self._current_epoch = to_epoch(timestamp)
+
+    def get_timestamp(self) -> datetime.datetime:
+        return self._current_timestamp
+
+    def get_trading_days(self, begin: datetime.date, end: datetime.date) -> list[datetime.date]:
+        if self._trading_days is None:
+            begins = [columns.begin for columns in self._ohlcv.values()] + list(self._other_event_begins.values())
+            days = np.unique(np.concatenate(begins) // DAY_MICROSECONDS) if len(begins) > 0 else np.empty(0, dtype=np.int64)
+            self._trading_days = [EPOCH.date() + datetime.timedelta(days=int(day)) for day in days]
+
+        return self._trading_days[bisect.bisect_left(self._trading_days, begin):bisect.bisect_right(self._trading_days, end)]
+
+    def get_ohlcv_panel(self, begin: datetime.datetime, end: datetime.datetime, tickers: list[str] | None = None) -> OHLCVPanel:
+        begin_epoch, end_epoch = to_epoch(begin), to_epoch(end)
+        columns = {}
+        others = []
+        for ticker in sorted(self._ohlcv.keys() | self._other_events.keys()) if tickers is None else tickers:
+            ohlcv = self._ohlcv.get(ticker)
+            if ohlcv is not None:
+                first, last = ohlcv.slice(begin_epoch, end_epoch)
+                if last > first:
+                    columns[ticker] = [ohlcv.begin[first:last], ohlcv.end[first:last]] + [getattr(ohlcv, field)[first:last].astype(np.float64)
+                                                                                          for field in ["open", "high", "low", "close", "volume"]]
+
+            other_begins = self._other_event_begins.get(ticker)
+            if other_begins is not None:
+                first = int(np.searchsorted(other_begins, begin_epoch, side="left"))
+                last = int(np.searchsorted(other_begins, end_epoch, side="right"))
+                others.extend(self._other_events[ticker][first:last])
+
+        return OHLCVPanel(columns, self._exchanges, others)
+
+    def get_fundamentals(self) -> Fundamentals:
+        # built from the dividends and earnings already loaded, so history before the loaded range isn't included
+        if self._fundamentals is None:
+            self._fundamentals = Fundamentals(event for events in self._other_events.values() for event in events)
+        return self._fundamentals
+
+    def get_current_price(self, ticker: str) -> int | None:
+        columns = self._ohlcv.get(ticker)
+        if columns is None:
+            return None
+
+        index = int(np.searchsorted(columns.begin, self._current_epoch, side="right")) - 1
+        if index < 0:
+            return None
+
+        return int(columns.open[index])
+
+    def get_current_prices(self, tickers: Sequence[str]) -> np.ndarray:
+        prices = np.full(len(tickers), np.nan)
+        for index, ticker in enumerate(tickers):
+            columns = self._ohlcv.get(ticker)
+            if columns is None:
+                continue
+
+            bar = int(np.searchsorted(columns.begin, self._current_epoch, side="right")) - 1
+            if bar >= 0:
+                prices[index] = columns.open[bar]
+
+        return prices
+
+    def get_events_many(self, tickers: Sequence[str], begin: datetime.datetime, end: datetime.datetime) -> dict[str, list[Event]]:
+        end_epoch = min(to_epoch(end), self._current_epoch)
+        begin_epoch = min(to_epoch(begin), self._current_epoch)
+
+        return {ticker: [event for _, event in self._iterate_ticker_events(ticker, begin_epoch, end_epoch)] for ticker in tickers}
+
+    def _reset_store(self):
+        self._ohlcv = {}
+        self._exchanges = {}
+        self._other_events = {}
+        self._other_event_begins = {}
+        self._trading_days = None
+        self._rollups = {}
+        self._fundamentals = None
+        self.update_timestamp(datetime.datetime.now())
+
+    def _index_other_events(self):
+        for ticker, events in self._other_events.items():
+            events.sort(key=lambda event: event.begin)
+            self._other_event_begins[ticker] = np.array([to_epoch(event.begin) for event in events], dtype=np.int64)
+
+    def _load(self, begin: datetime.datetime, end: datetime.datetime, tickers: list[str] | None):
+        rows = self._db.get_ohlcv_rows(tickers=tickers, begin=[begin, end])
+        for ticker, ticker_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            ticker_rows = list(ticker_rows)
+            self._exchanges[ticker] = ticker_rows[0][1]
+            self._ohlcv[ticker] = OHLCVColumns.from_rows([row[2:] for row in ticker_rows])
+
+        # dividends and earnings are sparse so they stay as decoded events
+        ticker_filter = None if tickers is None else set(tickers)
+        for event_type in [EVENT_TYPE_DIVIDEND_ANNOUNCEMENT, EVENT_TYPE_EX_DIVIDEND, EVENT_TYPE_DIVIDEND_PAYMENT, EVENT_TYPE_EARNINGS]:
+            for event in self._db.get_events(event_type=event_type, begin=[begin, end]):
+                if ticker_filter is not None and event.ticker not in ticker_filter:
+                    continue
+                event.begin = to_datetime(event.begin)
+                event.end = to_datetime(event.end)
+                self._other_events.setdefault(event.ticker, []).append(event)
+
+        self._index_other_events()
+
+    def _reload(self):
+        self._load(*self._load_arguments)
+
+    def _iterate_events(self, begin: int, end: int, tickers: list[str] | None = None) -> Iterator[Event]:
+        if tickers is None:
+            tickers = sorted(self._ohlcv.keys() | self._other_events.keys())
+
+        merged = heapq.merge(*(self._iterate_ticker_events(ticker, begin, end) for ticker in tickers), key=lambda pair: pair[0])
+        for _, event in merged:
+            yield event
+
+    def _iterate_ticker_events(self, ticker: str, begin: int, end: int) -> Iterator[tuple[int, Event]]:
+        iterators = []
+
+        columns = self._ohlcv.get(ticker)
+        if columns is not None:
+            iterators.append(self._iterate_ohlcv(ticker, columns, *columns.slice(begin, end)))
+
+        other_begins = self._other_event_begins.get(ticker)
+        if other_begins is not None:
+            first = int(np.searchsorted(other_begins, begin, side="left"))
+            last = int(np.searchsorted(other_begins, end, side="right"))
+            iterators.append(zip(other_begins[first:last].tolist(), self._other_events[ticker][first:last]))
+
+        return heapq.merge(*iterators, key=lambda pair: pair[0])
+
+    def _iterate_rollup_bars(self, ticker: str, resolution: str, begin: int, end: int) -> Iterator[tuple[int, Event]]:
+        # each ticker is rolled up once, over everything loaded, the first time a resolution is asked for
+        columns = self._ohlcv.get(ticker)
+        if columns is None:
+            return iter([])
+
+        rollup = self._rollups.get((ticker, resolution))
+        if rollup is None:
+            rollup = OHLCVColumns(*aggregate_bars(columns.begin, columns.end, columns.open, columns.high, columns.low, columns.close, columns.volume, resolution))
+            self._rollups[(ticker, resolution)] = rollup
+
+        # rolled-up ends never decrease, so the bars that have ended are a prefix
+        first, last = rollup.slice(begin, end)
+        last = min(last, int(np.searchsorted(rollup.end, self._current_epoch, side="right")))
+        return self._iterate_ohlcv(ticker, rollup, first, max(first, last))
+
+    def _iterate_ohlcv(self, ticker: str, columns: OHLCVColumns, first: int, last: int) -> Iterator[tuple[int, Event]]:
+        exchange = self._exchanges[ticker]
+        for begin, end, open, high, low, close, volume in zip(columns.begin[first:last].tolist(), columns.end[first:last].tolist(),
+                                                              columns.open[first:last].tolist(), columns.high[first:last].tolist(),
+                                                              columns.low[first:last].tolist(), columns.close[first:last].tolist(),
+                                                              columns.volume[first:last].tolist()):
+            yield begin, OHLCV(from_epoch(begin), from_epoch(end), ticker, exchange, open, high, low, close, volume)
+
+
+class SnapshotHistoricalData(ColumnarHistoricalData):
+    # ColumnarHistoricalData over a memory-mapped Snapshot: the OHLCV arrays are slices of the mapped files,
+    # so there is no load step and processes sharing a snapshot share its pages
+    _snapshot: Snapshot
+
+    def __init__(self, snapshot: Snapshot | str, tickers: list[str] | None = None):
+        self._snapshot = snapshot if isinstance(snapshot, Snapshot) else Snapshot(snapshot)
+        self._load_arguments = (tickers,)
+        self._reset_store()
+        self._load_snapshot(tickers)
+
+    def _reload(self):
+        self._load_snapshot(*self._load_arguments)
+
+    def _load_snapshot(self, tickers: list[str] | None):
+        ohlcv = self._snapshot.get_columns(EVENT_TYPE_OHLCV)
+        for ticker in self._snapshot.tickers if tickers is None else tickers:
+            first, last = self._snapshot.get_ticker_range(EVENT_TYPE_OHLCV, ticker)
+            if last > first:
+                self._exchanges[ticker] = self._snapshot.exchanges[int(ohlcv["exchange"][first])]
+                self._ohlcv[ticker] = OHLCVColumns(*(ohlcv[column][first:last] for column in ["begin", "end", "open", "high", "low", "close", "volume"]))
+
+            # dividends and earnings are sparse so they are decoded up front, as ColumnarHistoricalData does
+            for event_type in [EVENT_TYPE_DIVIDEND_ANNOUNCEMENT, EVENT_TYPE_EX_DIVIDEND, EVENT_TYPE_DIVIDEND_PAYMENT, EVENT_TYPE_EARNINGS]:
+                events = self._snapshot.get_events(event_type, ticker)
+                if len(events) > 0:
+                    self._other_events.setdefault(ticker, []).extend(events)
+
+        self._index_other_events()
@@ -0,0 +1,102 @@
+from abc import ABC, abstractmethod
+import datetime
+from typing import Callable
+import numpy as np
+
+class Indicator(ABC):
+    # computed once over a whole OHLCVPanel into a (rows, tickers) array. Every indicator here is trailing: row i only
+    # depends on bars at or before row i, and a ticker's value carries forward over rows where it has no bar
+    @abstractmethod
+    def compute(self, panel) -> np.ndarray:
+        pass
+
+class MovingAverage(Indicator):
+    # mean of the last window bars of field
+    def __init__(self, window: int, field: str = "close"):
+        self.window = window
+        self.field = field
+
+    def compute(self, panel) -> np.ndarray:
+        return per_ticker(panel, self.field, lambda values, begins: _rolling_mean(values, self.window))
+
+class Returns(Indicator):
+    # change in field over the last periods bars, as a fraction
+    def __init__(self, periods: int = 1, field: str = "close"):
+        self.periods = periods
+        self.field = field
+
+    def compute(self, panel) -> np.ndarray:
+        def returns(values: np.ndarray, begins: np.ndarray) -> np.ndarray:
+            result = np.full(len(values), np.nan)
+            result[self.periods:] = values[self.periods:] / values[:-self.periods] - 1
+            return result
+
+        return per_ticker(panel, self.field, returns)
+
+class ZScore(Indicator):
+    # distance of field from its mean over the last window bars, in standard deviations
+    def __init__(self, window: int, field: str = "close"):
+        self.window = window
+        self.field = field
+
+    def compute(self, panel) -> np.ndarray:
+        def zscore(values: np.ndarray, begins: np.ndarray) -> np.ndarray:
+            mean = _rolling_mean(values, self.window)
+            deviation = np.sqrt(np.maximum(_rolling_mean(values * values, self.window) - mean * mean, 0))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.where(deviation > 0, (values - mean) / deviation, np.nan)
+
+        return per_ticker(panel, self.field, zscore)
+
+class RollSpread(Indicator):
+    # Roll's spread estimate over the closes that began within lookback of each bar, the same formula RollSpreadEstimator
+    # applies incrementally, evaluated for every bar at once from prefix sums
+    def __init__(self, lookback: datetime.timedelta = datetime.timedelta(days=30)):
+        self.lookback = lookback
+
+    def compute(self, panel) -> np.ndarray:
+        lookback = self.lookback // datetime.timedelta(microseconds=1)
+        return per_ticker(panel, "close", lambda closes, begins: roll_spreads(closes, begins, lookback))
+
+def per_ticker(panel, field: str, function: Callable[[np.ndarray, np.ndarray], np.ndarray]) -> np.ndarray:
+    # applies function(values, begins) to each ticker's own bars and spreads the results back over the panel's rows
+    values = getattr(panel, field)
+    result = np.full(values.shape, np.nan)
+    for column in range(values.shape[1]):
+        rows = np.flatnonzero(~np.isnan(values[:, column]))
+        if len(rows) > 0:
+            result[rows, column] = function(values[rows, column], panel.begin[rows])
+    return forward_fill(result)
+
+def forward_fill(values: np.ndarray) -> np.ndarray:
+    # each NaN takes the last value above it in its column
+    rows = np.where(np.isnan(values), 0, np.arange(len(values))[:, np.newaxis])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    return values[rows, np.arange(values.shape[1])]
+
+def roll_spreads(closes: np.ndarray, begins: np.ndarray, lookback: int) -> np.ndarray:
+    # bar k's window holds the bars from the first that began at or after begins[k] - lookback up to k
+    changes = np.diff(closes)
+    change_sums = np.concatenate([[0], np.cumsum(changes)])
+    cross_sums = np.concatenate([[0, 0], np.cumsum(changes[1:] * changes[:-1])])
+
+    last = np.arange(len(closes))
+    first = np.searchsorted(begins, begins - lookback, side="left")
+    n = last - first
+
+    valid = n >= 2
+    first, last, n = first[valid], last[valid], n[valid]
+    total = change_sums[last] - change_sums[first]
+    cross = cross_sums[last] - cross_sums[first + 1]
+    scaled_covariance = n * n * cross - n * total * (2 * total - changes[first] - changes[last - 1]) + (n - 1) * total * total
+
+    spreads = np.zeros(len(closes))
+    spreads[valid] = np.where(scaled_covariance < 0, np.floor(2 * np.sqrt(np.maximum(-scaled_covariance, 0) / (n * n * (n - 1)))), 0)
+    return spreads
+
+def _rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        sums = np.concatenate([[0], np.cumsum(values)])
+        result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
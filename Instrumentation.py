@@ -0,0 +1,262 @@
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Iterator
+from Backtester import BaseBacktester
+from HistoricalData import SQLHistoricalData
+
+# stages that fire once per row are timed but left out of the trace so it stays a manageable size
+UNTRACED_STAGES = {"decode"}
+
+class Instrumentation:
+    # Opt-in profiler for a Backtester or MultiBacktester. attached() swaps timing wrappers onto the backtester's
+    # historical data, database, brokerages and strategies for the duration of the block and removes
+    # them afterwards, so an uninstrumented run executes exactly the original code.
+    #
+    # Times are exclusive: a stage's time does not include stages nested inside it, e.g. decoding
+    # inside an SQL call or get_ticker_price inside a strategy. Nesting is tracked per thread, so stages
+    # run by a prefetch worker are timed on their own and overlap the main thread's in the totals.
+    _local: threading.local
+    _lock: threading.Lock
+    _stage_ns: dict[str, int]
+    _stage_calls: dict[str, int]
+    _sql_statements: dict[str, int]
+    _sql_rows: dict[str, int]
+    _ticker_price_calls: dict[str, int]
+    _strategy_histograms: dict[str, dict[int, int]]
+    _trace_events: list[dict[str, Any]]
+    _max_trace_events: int
+    _patched: list[tuple[object, str]]
+    _started_ns: int
+    _wall_ns: int
+
+    def __init__(self, max_trace_events: int = 1000000):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stage_ns = {}
+        self._stage_calls = {}
+        self._sql_statements = {}
+        self._sql_rows = {}
+        self._ticker_price_calls = {}
+        self._strategy_histograms = {}
+        self._trace_events = []
+        self._max_trace_events = max_trace_events
+        self._patched = []
+        self._started_ns = 0
+        self._wall_ns = 0
+
+    @contextmanager
+    def attached(self, backtester: BaseBacktester):
+        self._attach(backtester)
+        self._started_ns = time.perf_counter_ns()
+        try:
+            yield self
+        finally:
+            self._wall_ns += time.perf_counter_ns() - self._started_ns
+            self._detach(backtester)
+
+    def summary(self) -> str:
+        lines = []
+        wall = self._wall_ns / 1e9
+        lines.append(f"{'stage':<40} {'calls':>12} {'seconds':>12} {'share':>8}")
+        for stage, nanoseconds in sorted(self._stage_ns.items(), key=lambda item: -item[1]):
+            share = nanoseconds / self._wall_ns if self._wall_ns > 0 else 0.0
+            lines.append(f"{stage:<40} {self._stage_calls[stage]:>12} {nanoseconds / 1e9:>12.4f} {share:>8.1%}")
+        other = max(0, self._wall_ns - sum(self._stage_ns.values()))
+        lines.append(f"{'(backtester loop)':<40} {'':>12} {other / 1e9:>12.4f} {other / self._wall_ns if self._wall_ns > 0 else 0.0:>8.1%}")
+        lines.append(f"{'total':<40} {'':>12} {wall:>12.4f}")
+
+        lines.append("")
+        lines.append(f"{'sql method':<40} {'statements':>12} {'rows':>12}")
+        for method in sorted(self._sql_statements.keys() | self._sql_rows.keys()):
+            lines.append(f"{method:<40} {self._sql_statements.get(method, 0):>12} {self._sql_rows.get(method, 0):>12}")
+
+        lines.append("")
+        lines.append(f"{'get_ticker_price ticker':<40} {'calls':>12}")
+        for ticker, calls in sorted(self._ticker_price_calls.items(), key=lambda item: -item[1])[:20]:
+            lines.append(f"{ticker:<40} {calls:>12}")
+
+        lines.append("")
+        lines.append(f"{'strategy':<40} {'calls':>12} {'p50 us':>12} {'p99 us':>12}")
+        for strategy, histogram in self._strategy_histograms.items():
+            lines.append(f"{strategy:<40} {sum(histogram.values()):>12} {self._histogram_percentile(histogram, 0.5):>12} {self._histogram_percentile(histogram, 0.99):>12}")
+
+        return "\n".join(lines)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "wall_seconds": self._wall_ns / 1e9,
+            "stages": {stage: {"calls": self._stage_calls[stage], "seconds": nanoseconds / 1e9} for stage, nanoseconds in self._stage_ns.items()},
+            "sql": {method: {"statements": self._sql_statements.get(method, 0), "rows": self._sql_rows.get(method, 0)}
+                    for method in self._sql_statements.keys() | self._sql_rows.keys()},
+            "get_ticker_price_calls": self._ticker_price_calls,
+            # bucket b holds calls that took [2^(b-1), 2^b) microseconds
+            "strategy_latency_histograms_us": {strategy: {str(bucket): count for bucket, count in sorted(histogram.items())}
+                                               for strategy, histogram in self._strategy_histograms.items()},
+        }
+
+    def write_json(self, path: str):
+        with open(path, "w") as output:
+            json.dump(self.to_dict(), output, indent=2)
+
+    def write_chrome_trace(self, path: str):
+        # loadable in chrome://tracing or Perfetto
+        with open(path, "w") as output:
+            json.dump({"traceEvents": self._trace_events, "displayTimeUnit": "ms"}, output)
+
+    def _attach(self, backtester: BaseBacktester):
+        historical_data = backtester.get_historical_data()
+        self._wrap_call(historical_data, "get_events_unrestricted", "feed")
+        self._wrap_iterator(historical_data, "stream_events_unrestricted", "feed")
+        self._wrap_iterator(historical_data, "stream_event_batches", "feed")
+        self._wrap_iterator(historical_data, "prefetch_event_batches", "feed")
+
+        if isinstance(historical_data, SQLHistoricalData):
+            db = historical_data.get_db()
+            for method in ["get_events", "get_latest_event", "get_ohlcv_rows", "get_events_many", "get_latest_events"]:
+                self._wrap_call(db, method, f"sql:{method}", self._count_sql_rows(method))
+            self._wrap_iterator(db, "iterate_events", "sql:iterate_events", self._count_sql_rows("iterate_events"))
+            self._wrap_iterator(db, "iterate_event_batches", "sql:iterate_event_batches", self._count_sql_rows("iterate_event_batches"))
+            self._wrap_call(db, "sql_to_event_from_joined_row", "decode")
+            db.set_trace_callback(self._count_sql_statement)
+
+        pairs = backtester.get_pairs()
+        for index, (strategy, brokerage) in enumerate(pairs):
+            label = f"{type(strategy).__name__}[{index}]" if len(pairs) > 1 else type(strategy).__name__
+            self._strategy_histograms[label] = {}
+            self._wrap_call(strategy, "run", "strategy.run", self._record_strategy_latency(label))
+            self._wrap_call(brokerage, "handle_events", "brokerage.handle_events")
+            self._wrap_call(brokerage, "handle_end_of_day", "brokerage.handle_end_of_day")
+            self._wrap_call(brokerage, "get_brokerage_value", "brokerage.get_brokerage_value")
+            self._wrap_call(brokerage, "get_ticker_price", "brokerage.get_ticker_price", self._count_ticker_price)
+            self._wrap_call(brokerage, "get_ticker_prices", "brokerage.get_ticker_prices", self._count_ticker_prices)
+
+    def _detach(self, backtester: BaseBacktester):
+        historical_data = backtester.get_historical_data()
+        if isinstance(historical_data, SQLHistoricalData):
+            historical_data.get_db().set_trace_callback(None)
+
+        for obj, name in reversed(self._patched):
+            delattr(obj, name)
+        self._patched = []
+
+    def _wrap_call(self, obj: object, name: str, stage: str, on_return: Callable | None = None):
+        if not hasattr(obj, name) or name in vars(obj):
+            return
+        original = getattr(obj, name)
+
+        def wrapper(*args, **kwargs):
+            self._enter(stage)
+            try:
+                result = original(*args, **kwargs)
+            finally:
+                duration = self._exit()
+            if on_return is not None:
+                on_return(args, result, duration)
+            return result
+
+        setattr(obj, name, wrapper)
+        self._patched.append((obj, name))
+
+    def _wrap_iterator(self, obj: object, name: str, stage: str, on_item: Callable | None = None):
+        if not hasattr(obj, name) or name in vars(obj):
+            return
+        original = getattr(obj, name)
+
+        def wrapper(*args, **kwargs):
+            return self._timed_iterator(stage, original(*args, **kwargs), on_item)
+
+        setattr(obj, name, wrapper)
+        self._patched.append((obj, name))
+
+    def _timed_iterator(self, stage: str, iterator: Iterator, on_item: Callable | None) -> Iterator:
+        # the work of a generator happens inside next(), so each step is timed as its own call
+        iterator = iter(iterator)
+        while True:
+            self._enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                duration = self._exit()
+            if on_item is not None:
+                on_item((), [item], duration)
+            yield item
+
+    def _get_stack(self) -> list[list]:
+        # the calling thread's open stages as [stage, started, child_ns]
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, stage: str):
+        self._get_stack().append([stage, time.perf_counter_ns(), 0])
+
+    def _exit(self) -> int:
+        stack = self._get_stack()
+        stage, started, child_ns = stack.pop()
+        duration = time.perf_counter_ns() - started
+        if len(stack) > 0:
+            stack[-1][2] += duration
+
+        with self._lock:
+            self._stage_ns[stage] = self._stage_ns.get(stage, 0) + duration - child_ns
+            self._stage_calls[stage] = self._stage_calls.get(stage, 0) + 1
+
+            if stage not in UNTRACED_STAGES and len(self._trace_events) < self._max_trace_events:
+                self._trace_events.append({
+                    "name": stage, "ph": "X", "pid": os.getpid(), "tid": threading.get_ident(),
+                    "ts": (started - self._started_ns) / 1000, "dur": duration / 1000,
+                })
+
+        return duration
+
+    def _count_sql_statement(self, statement: str):
+        # runs on the thread executing the statement, so its own stack says which method issued it
+        method = "other"
+        for stage, _, _ in reversed(self._get_stack()):
+            if stage.startswith("sql:"):
+                method = stage[4:]
+                break
+        with self._lock:
+            self._sql_statements[method] = self._sql_statements.get(method, 0) + 1
+
+    def _count_sql_rows(self, method: str) -> Callable:
+        def count(args, result, duration):
+            if method == "get_events_many":
+                rows = sum(len(events) for events in result.values())
+            else:
+                rows = 0 if result is None else len(result[0]) if method == "iterate_event_batches" else len(result) if isinstance(result, (list, dict)) else 1
+            with self._lock:
+                self._sql_rows[method] = self._sql_rows.get(method, 0) + rows
+        return count
+
+    def _count_ticker_price(self, args, result, duration):
+        ticker = args[0] if len(args) > 0 else "?"
+        self._ticker_price_calls[ticker] = self._ticker_price_calls.get(ticker, 0) + 1
+
+    def _count_ticker_prices(self, args, result, duration):
+        for ticker in args[0] if len(args) > 0 else []:
+            self._ticker_price_calls[ticker] = self._ticker_price_calls.get(ticker, 0) + 1
+
+    def _record_strategy_latency(self, label: str) -> Callable:
+        histogram = self._strategy_histograms[label]
+
+        def record(args, result, duration):
+            bucket = (duration // 1000).bit_length()
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        return record
+
+    def _histogram_percentile(self, histogram: dict[int, int], percentile: float) -> int:
+        # upper bound of the bucket containing the percentile
+        total = sum(histogram.values())
+        seen = 0
+        for bucket in sorted(histogram):
+            seen += histogram[bucket]
+            if seen >= total * percentile:
+                return 2 ** bucket
+        return 0
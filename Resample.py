@@ -0,0 +1,63 @@
+import itertools
+from typing import Iterable, Iterator, Sequence
+import numpy as np
+
+MINUTE_MICROSECONDS = 60 * 1000000
+
+# bucket widths in epoch microseconds. Buckets are aligned to the epoch, apart from weeks which start on Monday
+RESOLUTIONS = {
+    "1m": MINUTE_MICROSECONDS,
+    "5m": 5 * MINUTE_MICROSECONDS,
+    "15m": 15 * MINUTE_MICROSECONDS,
+    "30m": 30 * MINUTE_MICROSECONDS,
+    "1h": 60 * MINUTE_MICROSECONDS,
+    "1d": 24 * 60 * MINUTE_MICROSECONDS,
+    "1w": 7 * 24 * 60 * MINUTE_MICROSECONDS,
+}
+
+# 1970-01-05, the first Monday after the epoch
+WEEK_ORIGIN = 4 * 24 * 60 * MINUTE_MICROSECONDS
+
+def get_resolution_width(resolution: str) -> int:
+    width = RESOLUTIONS.get(resolution)
+    if width is None:
+        raise ValueError(f"Unsupported resolution {resolution}, expected one of {', '.join(RESOLUTIONS)}")
+    return width
+
+def bucket_begins(begins: np.ndarray, resolution: str) -> np.ndarray:
+    width = get_resolution_width(resolution)
+    origin = WEEK_ORIGIN if resolution == "1w" else 0
+    return (begins - origin) // width * width + origin
+
+def aggregate_bars(begin: np.ndarray, end: np.ndarray, open: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                   volume: np.ndarray, resolution: str) -> tuple[np.ndarray, ...]:
+    # rolls one ticker's bars, sorted by begin, up into (begin, end, open, high, low, close, volume) arrays at resolution.
+    # A rolled-up bar begins at its bucket and ends at the later of the bucket's last microsecond and its last bar's end,
+    # so it only becomes visible once nothing more can fall into it
+    if len(begin) == 0:
+        return begin, end, open, high, low, close, volume
+
+    buckets = bucket_begins(begin, resolution)
+    firsts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+    lasts = np.concatenate([firsts[1:], [len(begin)]]) - 1
+
+    ends = np.maximum(buckets[firsts] + get_resolution_width(resolution) - 1, np.maximum.reduceat(end, firsts))
+    return (buckets[firsts], np.maximum.accumulate(ends), open[firsts], np.maximum.reduceat(high, firsts),
+            np.minimum.reduceat(low, firsts), close[lasts], np.add.reduceat(volume, firsts))
+
+def iterate_rollup_rows(rows: Iterable[tuple], resolutions: Sequence[str], since: dict[tuple[str, str], int] | None = None) -> Iterator[tuple[str, list[tuple]]]:
+    # rows are (ticker, exchange, begin, end, open, high, low, close, volume) ordered by ticker then begin, with epoch
+    # timestamps as SqliteDB.iterate_ohlcv_row_chunks returns them. Yields (resolution, rolled-up rows of one ticker) in
+    # the same layout. since maps (resolution, ticker) to the first bucket to produce; earlier bars are left out
+    for ticker, ticker_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        ticker_rows = list(ticker_rows)
+        exchange = ticker_rows[0][1]
+        columns = [np.array(column) for column in list(zip(*ticker_rows))[2:]]
+
+        for resolution in resolutions:
+            first = 0
+            if since is not None and (resolution, ticker) in since:
+                first = int(np.searchsorted(columns[0], since[(resolution, ticker)], side="left"))
+
+            bars = aggregate_bars(*(column[first:] for column in columns), resolution)
+            yield resolution, [(ticker, exchange, *bar) for bar in zip(*(column.tolist() for column in bars))]
@@ -0,0 +1,268 @@
+import datetime
+import json
+import os
+import numpy as np
+from Brokerage import Brokerage
+
+RESULTS_MANIFEST = "results.json"
+
+# date is a proleptic Gregorian ordinal; traded_value is cumulative
+DAY_DTYPE = np.dtype([("date", np.int64), ("value", np.float64), ("cash", np.float64), ("traded_value", np.float64)])
+# day indexes into the day records and ticker into the recorder's ticker list
+POSITION_DTYPE = np.dtype([("day", np.int64), ("ticker", np.int32), ("quantity", np.int64), ("market_value", np.float64)])
+# prices are the ask paid on the buy and the bid received on the sell
+PNL_DTYPE = np.dtype([("day", np.int64), ("ticker", np.int32), ("quantity", np.int64), ("unit_buy_price", np.float64), ("unit_sell_price", np.float64)])
+
+class RecordBuffer:
+    # rows of a structured dtype in a preallocated array that doubles when full. With a spill path, every
+    # spill_rows rows are appended to that file and the array reused, so memory stays bounded on long runs
+    dtype: np.dtype
+    _rows: np.ndarray
+    _size: int
+    _spill_path: str | None
+    _spill_rows: int
+    _spilled: int
+    # set when the spill file may not match the buffer, as after unpickling, so the next flush rewrites it
+    _rewrite_spill: bool
+
+    def __init__(self, dtype: np.dtype, capacity: int = 1024, spill_path: str | None = None, spill_rows: int = 100000):
+        self.dtype = dtype
+        self._rows = np.empty(capacity if spill_path is None else min(capacity, spill_rows), dtype=dtype)
+        self._size = 0
+        self._spill_path = spill_path
+        self._spill_rows = spill_rows
+        self._spilled = 0
+        self._rewrite_spill = False
+
+        if spill_path is not None:
+            open(spill_path, "wb").close()
+
+    def __getstate__(self):
+        # rows written to the spill file after a pickle is taken must not end up in what it restores, so a
+        # pickle holds every row itself
+        state = self.__dict__.copy()
+        state["_rows"] = self.to_array()
+        state["_size"] = len(state["_rows"])
+        state["_spilled"] = 0
+        state["_rewrite_spill"] = self._spill_path is not None
+        return state
+
+    def set_spill_path(self, spill_path: str | None):
+        # moves the rows spilled so far into the buffer, the next flush writes them all to the new path
+        self._rows = self.to_array()
+        self._size = len(self._rows)
+        self._spilled = 0
+        self._spill_path = spill_path
+        self._rewrite_spill = spill_path is not None
+
+    def __len__(self) -> int:
+        return self._spilled + self._size
+
+    def append(self, row: tuple):
+        if self._size == len(self._rows):
+            self._make_room(1)
+        self._rows[self._size] = row
+        self._size += 1
+
+    def extend(self, rows: np.ndarray):
+        if self._size + len(rows) > len(self._rows):
+            self._make_room(len(rows))
+        self._rows[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+
+    def flush(self):
+        if self._spill_path is None or (self._size == 0 and not self._rewrite_spill):
+            return
+
+        with open(self._spill_path, "wb" if self._rewrite_spill else "ab") as output:
+            self._rows[:self._size].tofile(output)
+        self._spilled += self._size
+        self._size = 0
+        self._rewrite_spill = False
+
+    def to_array(self) -> np.ndarray:
+        if self._spilled == 0:
+            return self._rows[:self._size].copy()
+        return np.concatenate([np.fromfile(self._spill_path, dtype=self.dtype), self._rows[:self._size]])
+
+    def _make_room(self, count: int):
+        if self._spill_path is not None and self._size + count > self._spill_rows:
+            self.flush()
+        if self._size + count > len(self._rows):
+            rows = np.empty(max(2 * len(self._rows), self._size + count), dtype=self.dtype)
+            rows[:self._size] = self._rows[:self._size]
+            self._rows = rows
+
+class ResultsRecorder:
+    # Collects a run's daily equity, cash, positions and closed trades into NumPy record buffers, and computes the
+    # performance statistics over them in one pass at the end. With a directory the buffers stream to
+    # <directory>/<name>.bin in chunks and close() writes a manifest that load_results() reads back
+    _directory: str | None
+    _days: RecordBuffer
+    _positions: RecordBuffer
+    _pnls: RecordBuffer
+    _tickers: list[str]
+    _ticker_ids: dict[str, int]
+    _pnls_recorded: int
+    _record_positions: bool
+
+    def __init__(self, directory: str | None = None, chunk_rows: int = 100000, record_positions: bool = True):
+        self._directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        def spill_path(name: str) -> str | None:
+            return None if directory is None else os.path.join(directory, f"{name}.bin")
+
+        self._days = RecordBuffer(DAY_DTYPE, spill_path=spill_path("days"), spill_rows=chunk_rows)
+        self._positions = RecordBuffer(POSITION_DTYPE, spill_path=spill_path("positions"), spill_rows=chunk_rows)
+        self._pnls = RecordBuffer(PNL_DTYPE, spill_path=spill_path("pnls"), spill_rows=chunk_rows)
+        self._tickers = []
+        self._ticker_ids = {}
+        self._pnls_recorded = 0
+        self._record_positions = record_positions
+
+    def set_directory(self, directory: str | None):
+        # redirects the spill files and manifest, so a run forked from a checkpoint doesn't write over the original's
+        self._directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        for name, buffer in [("days", self._days), ("positions", self._positions), ("pnls", self._pnls)]:
+            buffer.set_spill_path(None if directory is None else os.path.join(directory, f"{name}.bin"))
+
+    def record_day(self, date: datetime.date, value: float, brokerage: Brokerage):
+        day = len(self._days)
+        self._days.append((date.toordinal(), value, brokerage.get_cash(), brokerage.get_traded_value()))
+
+        if self._record_positions:
+            position_values = brokerage.get_position_values()
+            if len(position_values) > 0:
+                quantities = {}
+                for position in brokerage.get_positions():
+                    quantities[position.symbol] = quantities.get(position.symbol, 0) + position.quantity
+                self._positions.extend(np.array([(day, self._get_ticker_id(ticker), quantities.get(ticker, 0), market_value)
+                                                 for ticker, market_value in position_values.items()], dtype=POSITION_DTYPE))
+
+        # the brokerage's PNL list only grows, so each day records the ones added since the last
+        pnls = brokerage.get_pnls()
+        for pnl in pnls[self._pnls_recorded:]:
+            self._pnls.append((day, self._get_ticker_id(pnl.ticker), pnl.quantity, _price(pnl.unit_buy_price, 1), _price(pnl.unit_sell_price, 0)))
+        self._pnls_recorded = len(pnls)
+
+    def get_tickers(self) -> list[str]:
+        return self._tickers
+
+    def get_days(self) -> np.ndarray:
+        return self._days.to_array()
+
+    def get_positions(self) -> np.ndarray:
+        return self._positions.to_array()
+
+    def get_pnls(self) -> np.ndarray:
+        return self._pnls.to_array()
+
+    def compute_metrics(self, periods_per_year: int = 252, risk_free_rate: float = 0.0) -> dict[str, float | None]:
+        # returns are per recorded day, so periods_per_year should match how days were recorded:
+        # 252 with skip_inactive_days, 365 when every calendar day is closed out
+        return compute_metrics(self.get_days(), periods_per_year, risk_free_rate)
+
+    def compute_attribution(self, brokerage: Brokerage) -> dict[str, dict[str, float]]:
+        # per ticker: realized trade PnL, dividends received, and unrealized PnL of what is still held at the brokerage's marks
+        pnls = self.get_pnls()
+        for ticker in list(brokerage.get_dividend_income()) + list(brokerage.get_position_values()):
+            self._get_ticker_id(ticker)
+
+        realized = np.bincount(pnls["ticker"], weights=pnls["quantity"] * (pnls["unit_sell_price"] - pnls["unit_buy_price"]), minlength=len(self._tickers))
+
+        cost_basis = {}
+        for position in brokerage.get_positions():
+            cost_basis[position.symbol] = cost_basis.get(position.symbol, 0) + position.quantity * _price(position.buy_price, 1)
+
+        attribution = {}
+        dividends = brokerage.get_dividend_income()
+        position_values = brokerage.get_position_values()
+        for ticker_id, ticker in enumerate(self._tickers):
+            unrealized = position_values.get(ticker, 0) - cost_basis.get(ticker, 0)
+            attribution[ticker] = {
+                "realized": float(realized[ticker_id]),
+                "dividends": float(dividends.get(ticker, 0)),
+                "unrealized": float(unrealized),
+                "total": float(realized[ticker_id] + dividends.get(ticker, 0) + unrealized),
+            }
+        return attribution
+
+    def close(self, brokerage: Brokerage | None = None, periods_per_year: int = 252) -> dict:
+        # flushes the buffers and, with a directory, writes the manifest; the summary is returned either way
+        summary = {"metrics": self.compute_metrics(periods_per_year)}
+        if brokerage is not None:
+            summary["attribution"] = self.compute_attribution(brokerage)
+
+        if self._directory is not None:
+            for buffer in [self._days, self._positions, self._pnls]:
+                buffer.flush()
+
+            manifest = {
+                "tickers": self._tickers,
+                "tables": {name: {"rows": len(buffer), "dtype": buffer.dtype.descr}
+                           for name, buffer in [("days", self._days), ("positions", self._positions), ("pnls", self._pnls)]},
+                **summary,
+            }
+            with open(os.path.join(self._directory, RESULTS_MANIFEST), "w") as output:
+                json.dump(manifest, output, indent=2)
+
+        return summary
+
+    def _get_ticker_id(self, ticker: str) -> int:
+        ticker_id = self._ticker_ids.get(ticker)
+        if ticker_id is None:
+            ticker_id = len(self._tickers)
+            self._ticker_ids[ticker] = ticker_id
+            self._tickers.append(ticker)
+        return ticker_id
+
+def compute_metrics(days: np.ndarray, periods_per_year: int = 252, risk_free_rate: float = 0.0) -> dict[str, float | None]:
+    # statistics that are undefined for the run (too few days, no volatility) come back as None
+    values = days["value"]
+    metrics = {"days": len(values), "total_return": None, "sharpe": None, "sortino": None, "max_drawdown": None, "turnover": None, "annualized_turnover": None}
+    if len(values) == 0:
+        return metrics
+
+    metrics["max_drawdown"] = float(np.max(1 - values / np.maximum.accumulate(values))) if np.all(values > 0) else None
+    mean_value = float(np.mean(values))
+    if mean_value > 0:
+        traded = float(days["traded_value"][-1])
+        metrics["turnover"] = traded / mean_value
+        metrics["annualized_turnover"] = traded / mean_value * periods_per_year / len(values)
+
+    if len(values) < 2 or values[0] == 0:
+        return metrics
+
+    metrics["total_return"] = float(values[-1] / values[0] - 1)
+    returns = values[1:] / values[:-1] - 1
+    excess = returns - risk_free_rate / periods_per_year
+    mean = float(np.mean(excess))
+
+    deviation = float(np.std(excess, ddof=1)) if len(excess) > 1 else 0.0
+    if deviation > 0:
+        metrics["sharpe"] = mean / deviation * np.sqrt(periods_per_year)
+
+    downside_deviation = float(np.sqrt(np.mean(np.minimum(excess, 0) ** 2)))
+    if downside_deviation > 0:
+        metrics["sortino"] = mean / downside_deviation * np.sqrt(periods_per_year)
+
+    return metrics
+
+def load_results(directory: str) -> dict:
+    # the manifest plus each recorded table as a structured array
+    with open(os.path.join(directory, RESULTS_MANIFEST)) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    for name, table in manifest["tables"].items():
+        dtype = np.dtype([tuple(field) for field in table["dtype"]])
+        manifest[name] = np.fromfile(os.path.join(directory, f"{name}.bin"), dtype=dtype, count=table["rows"])
+    return manifest
+
+def _price(price: tuple[float, float] | float, side: int) -> float:
+    # trades carry the (bid, ask) quote they executed against; side 0 is the bid and 1 the ask
+    return price[side] if isinstance(price, tuple) else price
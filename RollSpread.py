@@ -0,0 +1,85 @@
+from collections import deque
+import datetime
+import numpy as np
+
+class RollSpreadEstimator:
+    # Roll's estimator over a sliding window of closes, kept as running integer sums so it can be
+    # updated per bar and read in O(1). Matches the batch formula: mean over all n changes,
+    # serial covariance over the n - 1 adjacent pairs.
+    _bars: deque[tuple[datetime.datetime, int]]
+    _sum_changes: int
+    _sum_cross: int
+    _updated: datetime.datetime | None
+
+    def __init__(self):
+        self._bars = deque()
+        self._sum_changes = 0
+        self._sum_cross = 0
+        self._updated = None
+
+    def add_bar(self, begin: datetime.datetime, close: int):
+        if len(self._bars) > 0 and begin <= self._bars[-1][0]:
+            return  # already seen
+
+        if len(self._bars) > 0:
+            change = close - self._bars[-1][1]
+            if len(self._bars) > 1:
+                self._sum_cross += change * (self._bars[-1][1] - self._bars[-2][1])
+            self._sum_changes += change
+
+        self._bars.append((begin, close))
+
+    def evict_before(self, cutoff: datetime.datetime):
+        while len(self._bars) > 0 and self._bars[0][0] < cutoff:
+            _, first_close = self._bars.popleft()
+            if len(self._bars) == 0:
+                break
+
+            first_change = self._bars[0][1] - first_close
+            self._sum_changes -= first_change
+            if len(self._bars) > 1:
+                self._sum_cross -= (self._bars[1][1] - self._bars[0][1]) * first_change
+
+    def set_updated(self, timestamp: datetime.datetime):
+        self._updated = timestamp
+
+    def get_updated(self) -> datetime.datetime | None:
+        return self._updated
+
+    def get_closes(self) -> list[int]:
+        return [close for _, close in self._bars]
+
+    def get_spread(self) -> int:
+        n = len(self._bars) - 1
+        if n < 2:
+            return 0
+
+        first_change = self._bars[1][1] - self._bars[0][1]
+        last_change = self._bars[-1][1] - self._bars[-2][1]
+        total = self._sum_changes
+
+        # covariance * n^2 * (n - 1), kept in integers so eviction never accumulates float error
+        scaled_covariance = n * n * self._sum_cross - n * total * (2 * total - first_change - last_change) + (n - 1) * total * total
+        if scaled_covariance >= 0:
+            return 0
+
+        covariance = scaled_covariance / (n * n * (n - 1))
+        return int(2 * (-covariance) ** 0.5)
+
+
+def batch_roll_spreads(closes: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    # closes is (tickers, bars) with each row's valid closes left-aligned and lengths[i] of them
+    closes = np.asarray(closes, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+
+    n = lengths - 1
+    changes = np.diff(closes, axis=1)
+    valid = np.arange(changes.shape[1])[np.newaxis, :] < n[:, np.newaxis]
+    changes = np.where(valid, changes, 0.0)
+
+    mean = changes.sum(axis=1) / np.maximum(n, 1)
+    centered = np.where(valid, changes - mean[:, np.newaxis], 0.0)
+    covariance = (centered[:, 1:] * centered[:, :-1]).sum(axis=1) / np.maximum(n - 1, 1)
+
+    spreads = np.where((n >= 2) & (covariance < 0), 2 * np.sqrt(np.maximum(-covariance, 0.0)), 0.0)
+    return spreads.astype(np.int64)
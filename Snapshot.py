@@ -0,0 +1,210 @@
+import json
+import os
+import numpy as np
+from DB import (EVENT_TYPE_DIVIDEND_ANNOUNCEMENT, EVENT_TYPE_DIVIDEND_PAYMENT, EVENT_TYPE_EARNINGS, EVENT_TYPE_EX_DIVIDEND,
+                EVENT_TYPE_OHLCV, DividendAnnouncement, DividendPayment, Earnings, Event, ExDividend, SqliteDB, from_epoch, to_epoch)
+
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+OFFSETS_FILE = "offsets.bin"
+
+# stands in for NULL in integer columns
+NULL_INT = np.iinfo(np.int64).min
+
+# every column is int64 apart from exchange, which indexes the manifest's exchange list.
+# begin, end and dividend dates are epoch microseconds
+SNAPSHOT_COLUMNS = {
+    EVENT_TYPE_OHLCV: ["begin", "end", "exchange", "open", "high", "low", "close", "volume"],
+    EVENT_TYPE_DIVIDEND_ANNOUNCEMENT: ["begin", "end", "exchange", "amount", "ex_dividend", "payment"],
+    EVENT_TYPE_EX_DIVIDEND: ["begin", "end", "exchange", "amount", "ex_dividend", "payment"],
+    EVENT_TYPE_DIVIDEND_PAYMENT: ["begin", "end", "exchange", "amount"],
+    EVENT_TYPE_EARNINGS: ["begin", "end", "exchange", "eps", "eps_estimate", "number_of_estimates", "fiscal_quarter_ending"],
+}
+
+def _column_dtype(column: str) -> np.dtype:
+    return np.dtype(np.int32) if column == "exchange" else np.dtype(np.int64)
+
+def _nullable(value) -> int:
+    return NULL_INT if value is None else value
+
+def _nullable_epoch(value) -> int:
+    return NULL_INT if value is None else to_epoch(value)
+
+def _from_nullable(value: int):
+    return None if value == NULL_INT else value
+
+def _from_nullable_epoch(value: int):
+    return None if value == NULL_INT else from_epoch(value)
+
+def export_snapshot(db: SqliteDB, path: str, chunk_size: int = 100000) -> dict:
+    # writes one flat binary file per column per event type under path, rows ordered by ticker then begin, with a per-ticker
+    # offsets file for each type. OHLCV is streamed chunk_size rows at a time; the sparse types are small enough to decode whole.
+    # The manifest is written last so an interrupted export can't be opened
+    tickers = [row[0] for row in db.db_connection.execute("SELECT DISTINCT ticker FROM event ORDER BY ticker")]
+    ticker_indexes = {ticker: index for index, ticker in enumerate(tickers)}
+    exchanges: dict[str, int] = {}
+    tables = {}
+
+    def exchange_index(exchange: str) -> int:
+        return exchanges.setdefault(exchange, len(exchanges))
+
+    for event_type, columns in SNAPSHOT_COLUMNS.items():
+        directory = os.path.join(path, event_type)
+        os.makedirs(directory, exist_ok=True)
+        files = {column: open(os.path.join(directory, f"{column}.bin"), "wb") for column in columns}
+        counts = np.zeros(len(tickers), dtype=np.int64)
+
+        try:
+            for chunk in _iterate_snapshot_rows(db, event_type, chunk_size):
+                # zip stops before the trailing ticker
+                for column, values in zip(columns, zip(*chunk)):
+                    if column == "exchange":
+                        values = [exchange_index(exchange) for exchange in values]
+                    np.array(values, dtype=_column_dtype(column)).tofile(files[column])
+
+                for row in chunk:
+                    counts[ticker_indexes[row[-1]]] += 1
+        finally:
+            for file in files.values():
+                file.close()
+
+        np.concatenate([[0], np.cumsum(counts)]).astype(np.int64).tofile(os.path.join(directory, OFFSETS_FILE))
+        tables[event_type] = {"rows": int(counts.sum()), "columns": {column: _column_dtype(column).str for column in columns}}
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "tickers": tickers,
+        "exchanges": sorted(exchanges, key=exchanges.get),
+        "tables": tables,
+    }
+    with open(os.path.join(path, MANIFEST_FILE), "w") as output:
+        json.dump(manifest, output, indent=2)
+
+    return manifest
+
+def _iterate_snapshot_rows(db: SqliteDB, event_type: str, chunk_size: int):
+    # chunks of rows holding SNAPSHOT_COLUMNS[event_type] in order followed by the ticker
+    if event_type == EVENT_TYPE_OHLCV:
+        for chunk in db.iterate_ohlcv_row_chunks(chunk_size=chunk_size):
+            yield [(begin, end, exchange, open, high, low, close, volume, ticker)
+                   for ticker, exchange, begin, end, open, high, low, close, volume in chunk]
+        return
+
+    events = sorted(db.get_events(event_type=event_type), key=lambda event: event.ticker)
+    rows = [_event_to_row(event) + (event.ticker,) for event in events]
+    for first in range(0, len(rows), chunk_size):
+        yield rows[first:first + chunk_size]
+
+def _event_to_row(event: Event) -> tuple:
+    row = (to_epoch(event.begin), to_epoch(event.end), event.exchange)
+    if isinstance(event, DividendAnnouncement):
+        return row + (event.amount, _nullable_epoch(event.exDividend), _nullable_epoch(event.payment))
+    if isinstance(event, ExDividend):
+        return row + (event.amount, _nullable_epoch(event.exDividend), _nullable_epoch(event.payment_date))
+    if isinstance(event, DividendPayment):
+        return row + (event.amount,)
+    if isinstance(event, Earnings):
+        return row + (event.eps, _nullable(event.eps_estimate), event.number_of_estimates, _nullable_epoch(event.fiscal_quarter_ending))
+    raise ValueError(f"Unsupported event type {type(event).__name__}")
+
+class Snapshot:
+    # read-only view of an exported snapshot; every column is an np.memmap, so processes opening the same
+    # snapshot share the page cache and slicing a column doesn't copy
+    path: str
+    tickers: list[str]
+    exchanges: list[str]
+    _ticker_indexes: dict[str, int]
+    _columns: dict[str, dict[str, np.ndarray]]
+    _offsets: dict[str, np.ndarray]
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, MANIFEST_FILE)) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        if manifest["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {manifest['version']}")
+
+        self.path = path
+        self.tickers = manifest["tickers"]
+        self.exchanges = manifest["exchanges"]
+        self._ticker_indexes = {ticker: index for index, ticker in enumerate(self.tickers)}
+        self._columns = {}
+        self._offsets = {}
+
+        for event_type, table in manifest["tables"].items():
+            directory = os.path.join(path, event_type)
+            self._offsets[event_type] = self._open(os.path.join(directory, OFFSETS_FILE), np.dtype(np.int64), len(self.tickers) + 1)
+            self._columns[event_type] = {column: self._open(os.path.join(directory, f"{column}.bin"), np.dtype(dtype), table["rows"])
+                                         for column, dtype in table["columns"].items()}
+
+    def __getstate__(self):
+        # pickled as its path so the mapped files are mapped again rather than copied
+        return {"path": self.path}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state["path"])
+
+    def get_columns(self, event_type: str) -> dict[str, np.ndarray]:
+        return self._columns[event_type]
+
+    def get_ticker_range(self, event_type: str, ticker: str) -> tuple[int, int]:
+        # row range [first, last) of ticker's events of event_type
+        index = self._ticker_indexes.get(ticker)
+        if index is None:
+            return 0, 0
+
+        offsets = self._offsets[event_type]
+        return int(offsets[index]), int(offsets[index + 1])
+
+    def get_events(self, event_type: str, ticker: str) -> list[Event]:
+        # decodes one ticker's events of a sparse type
+        first, last = self.get_ticker_range(event_type, ticker)
+        columns = self._columns[event_type]
+        values = [columns[column][first:last].tolist() for column in SNAPSHOT_COLUMNS[event_type]]
+
+        events = []
+        for begin, end, exchange, *fields in zip(*values):
+            begin, end, exchange = from_epoch(begin), from_epoch(end), self.exchanges[exchange]
+            match event_type:
+                case 'DIVIDEND_ANNOUNCEMENT':
+                    amount, ex_dividend, payment = fields
+                    events.append(DividendAnnouncement(begin, end, ticker, exchange, amount, _from_nullable_epoch(ex_dividend), _from_nullable_epoch(payment)))
+                case 'EX_DIVIDEND':
+                    amount, ex_dividend, payment = fields
+                    events.append(ExDividend(begin, end, ticker, exchange, amount, _from_nullable_epoch(ex_dividend), _from_nullable_epoch(payment)))
+                case 'DIVIDEND_PAYMENT':
+                    events.append(DividendPayment(begin, end, ticker, exchange, fields[0]))
+                case 'EARNINGS':
+                    eps, eps_estimate, number_of_estimates, fiscal_quarter_ending = fields
+                    fiscal_quarter_ending = _from_nullable_epoch(fiscal_quarter_ending)
+                    events.append(Earnings(begin, end, ticker, exchange, eps, _from_nullable(eps_estimate), number_of_estimates,
+                                           None if fiscal_quarter_ending is None else fiscal_quarter_ending.date().isoformat()))
+                case _:
+                    raise ValueError(f"{event_type} is not a sparse event type")
+
+        return events
+
+    def _open(self, path: str, dtype: np.dtype, count: int) -> np.ndarray:
+        # np.memmap refuses empty files
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Memory-mapped snapshots of a simply_backtest event database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="write a snapshot directory from an event database")
+    export_parser.add_argument("db_path")
+    export_parser.add_argument("path")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        manifest = export_snapshot(SqliteDB(args.db_path), args.path)
+        for event_type, table in manifest["tables"].items():
+            print(f"{event_type}: {table['rows']} rows")
+        print(f"Wrote snapshot of {len(manifest['tickers'])} tickers to {args.path}")
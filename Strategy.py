@@ -1,14 +1,35 @@
 from abc import ABC, abstractmethod
 from Brokerage import Brokerage
 from DB import Event
-from HistoricalData import HistoricalData
+from HistoricalData import HistoricalData, OHLCVPanel
+from Indicators import Indicator
 import datetime
+import numpy as np
 
 class Strategy(ABC):
     @abstractmethod
     def run(self, timestamp: datetime.datetime, events: list[Event], brokerage: Brokerage, historical_data: HistoricalData):
         pass
 
+class VectorizedStrategy(Strategy):
+    # A bar-only strategy that Backtester runs as a batched simulation. Its indicators are computed over the whole range
+    # at once, then get_targets turns them into target share quantities for every panel row in one call. Row i of the
+    # targets must only depend on rows at or before i; NaN leaves a ticker's position as it is
+    def get_tickers(self) -> list[str] | None:
+        # the universe to load, None for every ticker
+        return None
+
+    @abstractmethod
+    def get_indicators(self) -> dict[str, Indicator]:
+        pass
+
+    @abstractmethod
+    def get_targets(self, panel: OHLCVPanel, indicators: dict[str, np.ndarray]) -> np.ndarray:
+        pass
+
+    def run(self, timestamp: datetime.datetime, events: list[Event], brokerage: Brokerage, historical_data: HistoricalData):
+        raise NotImplementedError(f"{type(self).__name__} is vectorized and runs through Backtester.run")
+
 class BlankStrategy(Strategy):
     def run(self, timestamp: datetime.datetime, events: list[Event], brokerage: Brokerage, historical_data: HistoricalData):
         pass
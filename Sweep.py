@@ -0,0 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import datetime
+import itertools
+import os
+import signal
+from typing import Any, Callable, Iterator
+from Backtester import Backtester, BaseBacktester, load_checkpoint
+from Brokerage import PNL, SimpleBrokerage
+from DB import SqliteDB
+from HistoricalData import SQLHistoricalData
+from Strategy import Strategy
+
+class SweepTimeout(Exception):
+    pass
+
+class SweepResult:
+    # one per strategy/brokerage pair; pair is its index in backtester.get_pairs(), always 0 for a Backtester
+    parameters: dict[str, Any]
+    final_value: int | None
+    equity_curve: list[tuple[datetime.date, int]]
+    pnls: list[PNL]
+    error: str | None
+    pair: int
+
+    def __init__(self, parameters: dict[str, Any], final_value: int | None, equity_curve: list[tuple[datetime.date, int]], pnls: list[PNL], error: str | None = None,
+                 pair: int = 0):
+        self.parameters = parameters
+        self.final_value = final_value
+        self.equity_curve = equity_curve
+        self.pnls = pnls
+        self.error = error
+        self.pair = pair
+
+def expand_parameter_grid(parameter_grid: dict[str, list[Any]]) -> list[dict[str, Any]]:
+    names = list(parameter_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(parameter_grid[name] for name in names))]
+
+def run_sweep(strategy_factory: Callable[..., Strategy], parameter_grid: dict[str, list[Any]], db_path: str,
+              start_date: datetime.date, end_date: datetime.date, cash: int,
+              max_workers: int | None = None, timeout: float | None = None) -> Iterator[SweepResult]:
+    # strategy_factory is called with each parameter combination as keyword arguments inside the worker,
+    # so it has to be picklable (a module-level function or class)
+    parameter_sets = expand_parameter_grid(parameter_grid)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_run_sweep_case, strategy_factory, parameters, db_path, start_date, end_date, cash, timeout): parameters
+            for parameters in parameter_sets
+        }
+
+        for future in as_completed(futures):
+            try:
+                yield from future.result()
+            except Exception as e:
+                yield SweepResult(futures[future], None, [], [], repr(e))
+
+def _run_sweep_case(strategy_factory: Callable[..., Strategy], parameters: dict[str, Any], db_path: str,
+                    start_date: datetime.date, end_date: datetime.date, cash: int, timeout: float | None) -> list[SweepResult]:
+    # every worker process opens its own (query_only) connection; sqlite connections can't cross processes
+    historical_data = SQLHistoricalData(SqliteDB(db_path))
+    brokerage = SimpleBrokerage(cash, historical_data)
+    backtester = Backtester(strategy_factory(**parameters), brokerage, historical_data, verbose=False)
+
+    return _run_timed_case(parameters, backtester, lambda: backtester.run(start_date, end_date, stream=True), timeout)
+
+def fork_sweep(checkpoint_path: str, configure: Callable[..., None], parameter_grid: dict[str, list[Any]],
+               end_date: datetime.date | None = None, max_workers: int | None = None, timeout: float | None = None) -> Iterator[SweepResult]:
+    # runs every parameter combination on from one shared checkpoint (typically a warm-up run saved with checkpoint_path)
+    # instead of from the start. Each worker loads its own copy, calls configure(backtester, **parameters) to set the
+    # variant up, through backtester.get_pairs() (or get_strategy() for a Backtester), then resumes through end_date.
+    # A MultiBacktester checkpoint yields one result per pair for each combination. configure has to be picklable
+    parameter_sets = expand_parameter_grid(parameter_grid)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_run_fork_case, checkpoint_path, configure, parameters, end_date, timeout): parameters
+            for parameters in parameter_sets
+        }
+
+        for future in as_completed(futures):
+            try:
+                yield from future.result()
+            except Exception as e:
+                yield SweepResult(futures[future], None, [], [], repr(e))
+
+def _run_fork_case(checkpoint_path: str, configure: Callable[..., None], parameters: dict[str, Any], end_date: datetime.date | None,
+                   timeout: float | None) -> list[SweepResult]:
+    backtester = load_checkpoint(checkpoint_path)
+    # forks share the checkpoint's paths, so they neither checkpoint nor spill results
+    backtester.set_checkpointing(None)
+    for recorder in backtester.get_recorders():
+        if recorder is not None:
+            recorder.set_directory(None)
+
+    configure(backtester, **parameters)
+    return _run_timed_case(parameters, backtester, lambda: backtester.resume(end_date), timeout)
+
+def _run_timed_case(parameters: dict[str, Any], backtester: BaseBacktester, run: Callable[[], Any], timeout: float | None) -> list[SweepResult]:
+    if timeout is not None:
+        signal.signal(signal.SIGALRM, _raise_sweep_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    error = None
+    try:
+        run()
+    except SweepTimeout:
+        error = f"timed out after {timeout}s"
+    finally:
+        if timeout is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    results = []
+    for pair, ((_, brokerage), equity_curve) in enumerate(zip(backtester.get_pairs(), backtester.get_equity_curves())):
+        final_value = None if error is not None else brokerage.get_brokerage_value()
+        results.append(SweepResult(parameters, final_value, equity_curve, brokerage.get_pnls(), error, pair))
+    return results
+
+def _raise_sweep_timeout(signum, frame):
+    raise SweepTimeout()
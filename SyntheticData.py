@@ -0,0 +1,102 @@
+import datetime
+import random
+import sqlite3
+from DB import EVENT_SCHEMA, EventWriter
+
+MARKET_OPEN = datetime.time(9, 30)
+MARKET_CLOSE = datetime.time(16, 0)
+SESSION_MINUTES = 390
+
+def generate_event_database(path: str, tickers: int = 100, start_date: datetime.date = datetime.date(2020, 1, 1), years: int = 1,
+                            bar_minutes: int = SESSION_MINUTES, dividends_per_year: int = 4, earnings_per_year: int = 4,
+                            seed: int = 0) -> int:
+    # writes a schema-conformant event database of random-walk bars on weekdays and returns the number of events written.
+    # bar_minutes >= 390 gives one bar per session
+    rng = random.Random(seed)
+    end_date = datetime.date(start_date.year + years, start_date.month, start_date.day)
+    ticker_names = [f"T{index:05d}" for index in range(tickers)]
+    prices = {ticker: rng.randint(1000, 50000) for ticker in ticker_names}
+
+    connection = sqlite3.connect(path)
+    with connection:
+        for statement in EVENT_SCHEMA:
+            connection.execute(statement)
+
+        writer = EventWriter(connection)
+        events_written = 0
+
+        bar_minutes = min(bar_minutes, SESSION_MINUTES)
+        bar_length = datetime.timedelta(minutes=bar_minutes)
+        dividend_interval = 365 // dividends_per_year if dividends_per_year > 0 else None
+        earnings_interval = 365 // earnings_per_year if earnings_per_year > 0 else None
+
+        date = start_date
+        day_index = 0
+        while date < end_date:
+            if date.weekday() < 5:
+                for ticker_index, ticker in enumerate(ticker_names):
+                    # stagger corporate actions across the universe
+                    if dividend_interval is not None and (day_index + ticker_index) % dividend_interval == 0:
+                        events_written += _write_dividend(writer, rng, ticker, date, prices[ticker])
+                    if earnings_interval is not None and (day_index + 2 * ticker_index) % earnings_interval == 0:
+                        events_written += _write_earnings(writer, rng, ticker, date)
+
+                begin = datetime.datetime.combine(date, MARKET_OPEN)
+                session_end = datetime.datetime.combine(date, MARKET_CLOSE)
+                while begin + bar_length <= session_end:
+                    for ticker in ticker_names:
+                        prices[ticker] = _write_bar(writer, rng, ticker, begin, begin + bar_length, prices[ticker])
+                        events_written += 1
+                    begin += bar_length
+
+            date += datetime.timedelta(days=1)
+            day_index += 1
+
+        writer.flush()
+
+    connection.close()
+    return events_written
+
+def _write_bar(writer: EventWriter, rng: random.Random, ticker: str, begin: datetime.datetime, end: datetime.datetime, open: int) -> int:
+    close = max(1, open + int(rng.gauss(0, open * 0.01)))
+    high = max(open, close) + rng.randint(0, max(1, open // 200))
+    low = max(1, min(open, close) - rng.randint(0, max(1, open // 200)))
+
+    writer.add_ohlcv(begin, end, ticker, "SYNTH", open, high, low, close, rng.randint(100, 1000000))
+    return close
+
+def _write_dividend(writer: EventWriter, rng: random.Random, ticker: str, date: datetime.date, price: int) -> int:
+    # announcement before the open, ex-date two weeks later, payment two weeks after that (possibly on a weekend)
+    announcement_time = datetime.datetime.combine(date, datetime.time(8, 0))
+    ex_dividend_time = datetime.datetime.combine(date + datetime.timedelta(days=14), datetime.time(0, 0))
+    payment_time = datetime.datetime.combine(date + datetime.timedelta(days=28), datetime.time(0, 0))
+    amount = max(1, price * rng.randint(2, 10) // 1000)
+
+    writer.add_dividend(ticker, "SYNTH", announcement_time, ex_dividend_time, payment_time, amount)
+    return 3
+
+def _write_earnings(writer: EventWriter, rng: random.Random, ticker: str, date: datetime.date) -> int:
+    report_time = datetime.datetime.combine(date, datetime.time(7, 0))
+    eps_estimate = rng.randint(-50, 500)
+
+    writer.add_earnings(report_time, report_time, ticker, "SYNTH", eps_estimate + rng.randint(-50, 50), eps_estimate, rng.randint(1, 30), date - datetime.timedelta(days=30))
+    return 1
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic simply_backtest event database")
+    parser.add_argument("path")
+    parser.add_argument("--tickers", type=int, default=100)
+    parser.add_argument("--start-date", type=datetime.date.fromisoformat, default=datetime.date(2020, 1, 1))
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--bar-minutes", type=int, default=SESSION_MINUTES)
+    parser.add_argument("--dividends-per-year", type=int, default=4)
+    parser.add_argument("--earnings-per-year", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    count = generate_event_database(args.path, args.tickers, args.start_date, args.years, args.bar_minutes,
+                                    args.dividends_per_year, args.earnings_per_year, args.seed)
+    print(f"Wrote {count} events to {args.path}")
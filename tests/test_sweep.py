@@ -0,0 +1,65 @@
+import datetime
+import os
+import tempfile
+import unittest
+from Backtester import MultiBacktester, load_checkpoint
+from Brokerage import SimpleBrokerage
+from DB import SqliteDB
+from HistoricalData import SQLHistoricalData
+from Strategy import Strategy
+from Sweep import fork_sweep
+from SyntheticData import generate_event_database
+
+START_DATE = datetime.date(2020, 1, 1)
+WARM_UP_END_DATE = datetime.date(2020, 1, 31)
+END_DATE = datetime.date(2020, 3, 31)
+
+class PeriodicBuyStrategy(Strategy):
+    # buys quantity shares of the first ticker in every tenth event group
+    def __init__(self):
+        self.quantity = 1
+        self.groups = 0
+
+    def run(self, timestamp, events, brokerage, historical_data):
+        self.groups += 1
+        if self.groups % 10 == 0:
+            brokerage.place_buy_trade(events[0].ticker, self.quantity)
+
+def configure(backtester, quantity):
+    # module level so fork_sweep can pickle it; each pair gets a different multiple so the pairs diverge
+    for index, (strategy, _) in enumerate(backtester.get_pairs()):
+        strategy.quantity = quantity * (index + 1)
+
+class ForkSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.directory.name, "events.sqlite")
+        generate_event_database(db_path, tickers=5, start_date=START_DATE, years=1, dividends_per_year=0, earnings_per_year=0)
+
+        historical_data = SQLHistoricalData(SqliteDB(db_path))
+        pairs = [(PeriodicBuyStrategy(), SimpleBrokerage(10 ** 8, historical_data)) for _ in range(2)]
+        self.checkpoint_path = os.path.join(self.directory.name, "warm.ckpt")
+        MultiBacktester(pairs, historical_data, verbose=False).run(START_DATE, WARM_UP_END_DATE, stream=True, checkpoint_path=self.checkpoint_path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_fork_multi_backtester_checkpoint(self):
+        expected = {}
+        for quantity in [1, 3]:
+            backtester = load_checkpoint(self.checkpoint_path)
+            configure(backtester, quantity)
+            expected[quantity] = backtester.resume(END_DATE)
+
+        results = list(fork_sweep(self.checkpoint_path, configure, {"quantity": [1, 3]}, end_date=END_DATE, max_workers=2))
+
+        self.assertEqual(sorted((result.parameters["quantity"], result.pair) for result in results), [(1, 0), (1, 1), (3, 0), (3, 1)])
+        for result in results:
+            self.assertIsNone(result.error)
+            self.assertEqual(result.final_value, expected[result.parameters["quantity"]][result.pair])
+            self.assertEqual(result.equity_curve[0][0], START_DATE)
+            self.assertEqual(result.equity_curve[-1][0], END_DATE)
+        self.assertNotEqual(expected[3][0], expected[3][1])
+
+if __name__ == "__main__":
+    unittest.main()